@@ -0,0 +1,7 @@
+'''Benchmarks for collecting, building and running specs.
+
+Run with `python -m benchmarks`, which writes a synthetic spec tree (see
+`benchmarks.generate.SpecTree`) and reports the time, and memory, taken
+by each phase. Save the results with --output, and compare two saved runs
+with --compare BEFORE AFTER.
+'''
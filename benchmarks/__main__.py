@@ -0,0 +1,254 @@
+import os
+import io
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from argparse import ArgumentParser
+from .generate import SpecTree
+
+VERSION = 2
+PHASES = ('import', 'collect', 'finalise', 'build', 'run')
+
+
+class PhaseTimer(object):
+    '''Totals the time spent in a method, while installed in its place.
+    While tracemalloc is tracing, it also totals the memory the method
+    left allocated.'''
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+        self.original = getattr(owner, name)
+        self.seconds = 0.0
+        self.calls = 0
+        self.retained = 0
+
+    def __enter__(self):
+        original = self.original
+        tracing = tracemalloc.is_tracing()
+        def timed(*args, **kwargs):
+            if tracing:
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+                if tracing:
+                    self.retained += \
+                        tracemalloc.get_traced_memory()[0] - before
+        setattr(self.owner, self.name, timed)
+        return self
+
+    def __exit__(self, exc, exv, tb):
+        setattr(self.owner, self.name, self.original)
+        return False
+
+
+def null_printer():
+    from withspec.printer import Printer
+    printer = Printer(colour=False, detailed=False)
+    printer.output = io.StringIO()
+    return printer
+
+
+def collect(directory):
+    from withspec.collector import WithSpecCollector
+    collector = WithSpecCollector()
+    collector.collect(directory)
+    return collector.tests
+
+
+def run(tests):
+    from withspec.hooks import default_hooks
+    from withspec.runner import WithSpecRunner
+    config = {'no_logs': False, 'no_stdout': False, 'backtrace': False}
+    runner = WithSpecRunner(hooks=default_hooks(config))
+    runner.run(tests, null_printer())
+    return runner
+
+
+def measure(directory, repeat):
+    '''Time each phase, taking the best of repeat, then measure memory in
+    a separate pass as tracing slows everything down'''
+    from withspec.context import Context
+    from withspec.elements import TestElement
+
+    results = {}
+    def best(phase, seconds, calls):
+        result = results.setdefault(phase, {'seconds': None,
+                                            'calls': calls})
+        if result['seconds'] is None or seconds < result['seconds']:
+            result['seconds'] = seconds
+
+    for i in range(repeat):
+        gc.collect()
+        with PhaseTimer(Context, 'finalise') as finalise, \
+             PhaseTimer(TestElement, 'build') as build:
+            start = time.perf_counter()
+            tests = collect(directory)
+            best('collect', time.perf_counter() - start, len(tests))
+        best('finalise', finalise.seconds, finalise.calls)
+        best('build', build.seconds, build.calls)
+
+        gc.collect()
+        start = time.perf_counter()
+        runner = run(tests)
+        best('run', time.perf_counter() - start, runner.total)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with PhaseTimer(Context, 'finalise') as finalise, \
+             PhaseTimer(TestElement, 'build') as build:
+            tests = collect(directory)
+        results['collect']['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        results['finalise']['retained_bytes'] = finalise.retained
+        results['build']['retained_bytes'] = build.retained
+
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run(tests)
+        results['run']['peak_bytes'] = \
+            tracemalloc.get_traced_memory()[1] - retained
+    finally:
+        tracemalloc.stop()
+
+    for phase, result in results.items():
+        result['per_second'] = result['calls'] / result['seconds'] \
+            if result['seconds'] else None
+    return results
+
+
+def import_time(repeat):
+    '''Time importing the command line entry point in a fresh
+    interpreter, as `-X importtime` reports it, taking the best of repeat.
+    Also counts the modules it imported, which catches a new slow import
+    even while the timing is noisy.'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        path for path in (root, env.get('PYTHONPATH')) if path)
+    result = {'seconds': None, 'calls': 1, 'per_second': None}
+    for i in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import withspec.command'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True).stderr
+        modules = 0
+        for line in output.splitlines():
+            fields = line.split(':', 1)[-1].split('|')
+            if len(fields) != 3 or not fields[0].strip().isdigit():
+                continue  # The header, or a warning
+            modules += 1
+            if fields[2].strip() == 'withspec.command':
+                seconds = int(fields[1]) / 1000000.0
+        if result['seconds'] is None or seconds < result['seconds']:
+            result['seconds'] = seconds
+        result['modules'] = modules
+    return result
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, output=sys.stdout):
+    output.write('%-10s %12s %10s %14s %12s %12s\n' % (
+        'phase', 'seconds', 'calls', 'per second', 'peak KiB',
+        'retained KiB'))
+    for phase in PHASES:
+        result = results['phases'][phase]
+        memory = [result.get(key) for key in ('peak_bytes', 'retained_bytes')]
+        output.write('%-10s %12.4f %10d %14.1f %12s %12s\n' % ((
+            phase, result['seconds'], result['calls'],
+            result['per_second'] or 0.0) + tuple(
+                '%.1f' % (value / 1024.0) if value is not None else '-'
+                for value in memory)))
+    output.write('Importing withspec.command imported %d modules\n' %
+                 results['phases']['import']['modules'])
+
+
+def compare(before, after, output=sys.stdout):
+    '''Print how after's phases changed since before'''
+    if before['params'] != after['params']:
+        output.write('Warning: the spec trees differ, %s and %s\n' % (
+            before['params'], after['params']))
+    output.write('%-10s %12s %12s %8s\n' % ('phase', 'before', 'after',
+                                           'change'))
+    for phase in PHASES:
+        if phase not in before['phases'] or phase not in after['phases']:
+            continue  # Saved before the phase was measured
+        old = before['phases'][phase]['seconds']
+        new = after['phases'][phase]['seconds']
+        output.write('%-10s %12.4f %12.4f %+7.1f%%\n' % (
+            phase, old, new, (new - old) / old * 100.0 if old else 0.0))
+
+
+def main(argv=sys.argv[1:]):
+    parser = ArgumentParser(
+        prog='python -m benchmarks',
+        description='Time the collection, build and run of a synthetic ' \
+                    'spec tree',
+    )
+    tree = SpecTree()
+    for name, value in tree.params().items():
+        parser.add_argument('--%s' % name, type=int, default=value)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Take the best time of this many rounds')
+    parser.add_argument('--output', metavar='FILE',
+                        help='Save the results as JSON, to compare later')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two saved results, and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare is not None:
+        before, after = [json.load(open(path)) for path in args.compare]
+        compare(before, after)
+        return
+
+    tree = SpecTree(**dict((name, getattr(args, name))
+                           for name in tree.params()))
+    directory = tempfile.mkdtemp(prefix='withspec-bench-')
+    try:
+        tree.write(directory)
+        phases = measure(directory, args.repeat)
+        phases['import'] = import_time(args.repeat)
+    finally:
+        shutil.rmtree(directory)
+
+    if phases['collect']['calls'] != tree.expected_tests():
+        sys.stderr.write('Collected %d tests, expected %d\n' % (
+            phases['collect']['calls'], tree.expected_tests()))
+
+    results = {
+        'version': VERSION,
+        'revision': revision(),
+        'python': platform.python_version(),
+        'params': tree.params(),
+        'repeat': args.repeat,
+        'phases': phases,
+    }
+    report(results)
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class SpecTree(object):
+    '''Writes a synthetic tree of spec files to benchmark against.
+
+    Each file has a describe with `breadth` child contexts, nested `depth`
+    deep. Every context has `fixtures` fixtures, each using the one before
+    it (and the first the last of its parent's), a before, and `tests`
+    tests using the last fixture. With `shared` groups, each file defines
+    that many and every innermost context behaves like all of them.
+    '''
+    def __init__(self, files=20, breadth=3, depth=3, fixtures=3, tests=5,
+                 shared=1):
+        self.files = files
+        self.breadth = breadth
+        self.depth = depth
+        self.fixtures = fixtures
+        self.tests = tests
+        self.shared = shared
+
+    def params(self):
+        return {
+            'files': self.files,
+            'breadth': self.breadth,
+            'depth': self.depth,
+            'fixtures': self.fixtures,
+            'tests': self.tests,
+            'shared': self.shared,
+        }
+
+    def expected_tests(self):
+        '''How many tests collecting the tree should give'''
+        contexts = sum(self.breadth ** level
+                       for level in range(self.depth + 1))
+        leaves = self.breadth ** self.depth
+        return self.files * (contexts * self.tests +
+                             leaves * self.shared * self.tests)
+
+    def write(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for index in range(self.files):
+            filepath = os.path.join(directory, 'spec_%04d.py' % index)
+            with open(filepath, 'w') as fh:
+                fh.write(self.source(index))
+        log.info('Wrote %d spec files to %s', self.files, directory)
+
+    def source(self, index):
+        lines = ['from withspec import describe, context, shared, '
+                 'it_behaves_like', '']
+        for group in range(self.shared):
+            lines.append("with shared('file %d group %d'):" % (index, group))
+            for test in range(self.tests):
+                lines.extend(self.function('shared_test_%d' % test,
+                                           ['test'], 1))
+            lines.append('')
+        lines.append("with describe('File %d') as expect:" % index)
+        self.context(lines, index, 0, 1, None)
+        lines.append('')
+        return '\n'.join(lines)
+
+    def context(self, lines, index, level, indent, parent_fixture):
+        previous = parent_fixture
+        for fixture in range(self.fixtures):
+            name = 'fixture_%d_%d' % (level, fixture)
+            lines.extend(self.function(name, [previous] if previous else [],
+                                       indent, value=True))
+            previous = name
+        lines.extend(self.function('before', [previous] if previous else [],
+                                   indent))
+        for test in range(self.tests):
+            args = ['test'] + ([previous] if previous else [])
+            lines.extend(self.function('test_%d_%d' % (level, test), args,
+                                       indent))
+        if level == self.depth:
+            for group in range(self.shared):
+                lines.append("%sit_behaves_like('file %d group %d')" %
+                             ('    ' * indent, index, group))
+            return
+        for child in range(self.breadth):
+            lines.append("%swith context('level %d child %d'):" %
+                         ('    ' * indent, level + 1, child))
+            self.context(lines, index, level + 1, indent + 1, previous)
+
+    def function(self, name, args, indent, value=False):
+        prefix = '    ' * indent
+        body = '%s    return %d' % (prefix, len(args)) if value else \
+               '%s    assert True' % prefix
+        return ['%sdef %s(%s):' % (prefix, name, ', '.join(args)), body]
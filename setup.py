@@ -25,7 +25,7 @@ setup(name='WithSpec',
       author_email='',
       url='',
       keywords='web pyramid pylons',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       include_package_data=True,
       zip_safe=False,
       install_requires=requires,
@@ -1,5 +1,7 @@
 import unittest
-from withspec.assertions import AssertionSubject
+from unittest import mock
+from withspec import assertions
+from withspec.assertions import AssertionSubject, get_assertor
 
 
 class TestAssertionSubject(unittest.TestCase):
@@ -57,3 +59,67 @@ class TestAssertionSubject(unittest.TestCase):
                                  'other_moron',
                                  'otherMoron',
                                  'moron'])
+
+
+class TestAssertionResolution(unittest.TestCase):
+
+    def setUp(self):
+        from withspec.assertions import Assertions
+        # A class of our own, so nothing is resolved for it yet
+        class Assertor(Assertions):
+            pass
+        self.assertor = Assertor()
+
+    def test_resolves(self):
+        AssertionSubject(self.assertor, 1).is_instance(int)
+        AssertionSubject(self.assertor, [1]).contains(1)
+        with self.assertRaises(AssertionError):
+            AssertionSubject(self.assertor, 1).equal(2)
+
+    def resolving(self):
+        return mock.patch.object(AssertionSubject, 'resolve', autospec=True,
+                                 side_effect=AssertionSubject.resolve)
+
+    def test_resolved_once(self):
+        with self.resolving() as resolve:
+            AssertionSubject(self.assertor, 1).is_true()
+            AssertionSubject(self.assertor, 2).is_true()
+        self.assertEqual(resolve.call_count, 1)
+        self.assertIs(assertions._resolved[type(self.assertor), 'is_true'],
+                      type(self.assertor).assertTrue)
+
+    def test_unknown_resolved_once(self):
+        with self.resolving() as resolve:
+            for i in range(2):
+                with self.assertRaises(AttributeError):
+                    AssertionSubject(self.assertor, 1).is_moron()
+        self.assertEqual(resolve.call_count, 1)
+        self.assertIsNone(
+            assertions._resolved[type(self.assertor), 'is_moron'])
+
+    def test_unknown(self):
+        with self.assertRaises(AttributeError):
+            AssertionSubject(self.assertor, 1).is_moron()
+
+    def test_to(self):
+        AssertionSubject(self.assertor, True).to.be_true()
+        with self.assertRaises(AssertionError):
+            AssertionSubject(self.assertor, False).to.be_true()
+
+
+class TestGetAssertor(unittest.TestCase):
+
+    def test_nothing_shared(self):
+        first = get_assertor()
+        first.maxDiff = None
+        first.longMessage = False
+        first.addTypeEqualityFunc(int, first.fail)
+        first.addCleanup(print)
+        second = get_assertor()
+        self.assertEqual(second.maxDiff, 80 * 8)
+        self.assertTrue(second.longMessage)
+        self.assertNotIn(int, second._type_equality_funcs)
+        self.assertEqual(second._cleanups, [])
+        second.assertEqual(1, 1)
+        with self.assertRaises(AssertionError):
+            second.assertEqual({'a': 1}, {'a': 2})
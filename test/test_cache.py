@@ -0,0 +1,108 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from withspec.cache import CollectionCache, write_atomic
+
+
+class TestCollectionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = CollectionCache(os.path.join(self.directory, 'cache'))
+        self.filepath = os.path.join(self.directory, 'spec.py')
+        self.write(b'value = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, source, mtime=None):
+        with open(self.filepath, 'wb') as fh:
+            fh.write(source)
+        if mtime is not None:
+            os.utime(self.filepath, ns=(mtime, mtime))
+        return source
+
+    def store(self, source, kinds=None, resolved=False):
+        code = compile(source, self.filepath, 'exec')
+        self.cache.store(self.filepath, self.filepath, source, code,
+                         kinds, resolved)
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.load(self.filepath, self.filepath))
+
+    def test_round_trip(self):
+        kinds = {(('Thing',), 0): {'before': 'before'},
+                 (('Thing', 'Child'), 1): {'test_it': 'test'}}
+        self.store(b'value = 1\n', kinds, True)
+        entry = self.cache.load(self.filepath, self.filepath)
+        namespace = {}
+        exec(entry.code, namespace)
+        self.assertEqual(namespace['value'], 1)
+        self.assertEqual(entry.kinds, kinds)
+        self.assertTrue(entry.resolved)
+        self.assertTrue(entry.fresh)
+
+    def test_touched_but_unchanged(self):
+        self.store(self.write(b'value = 1\n', mtime=10 ** 9))
+        self.write(b'value = 1\n', mtime=2 * 10 ** 9)
+        entry = self.cache.load(self.filepath, self.filepath)
+        self.assertIsNotNone(entry)
+        self.assertFalse(entry.fresh)
+
+    def test_touched_code_recompiled(self):
+        kinds = {(('Thing',), 0): {'test_it': 'test'}}
+        self.write(b'value = 1\n', mtime=10 ** 9)
+        # An entry whose code doesn't come from the source
+        code = compile(b'value = 2\n', self.filepath, 'exec')
+        self.cache.store(self.filepath, self.filepath, b'value = 1\n', code,
+                         kinds, True)
+        self.write(b'value = 1\n', mtime=2 * 10 ** 9)
+        entry = self.cache.load(self.filepath, self.filepath)
+        namespace = {}
+        exec(entry.code, namespace)
+        self.assertEqual(namespace['value'], 1)
+        self.assertEqual(entry.kinds, kinds)
+
+    def test_changed(self):
+        self.store(self.write(b'value = 1\n', mtime=10 ** 9))
+        self.write(b'value = 2\n', mtime=2 * 10 ** 9)
+        self.assertIsNone(self.cache.load(self.filepath, self.filepath))
+
+    def test_filepath_is_part_of_key(self):
+        self.store(b'value = 1\n')
+        self.assertIsNone(self.cache.load(self.filepath, 'spec.py'))
+
+    def test_never_unpickled(self):
+        self.store(b'value = 1\n')
+        path = self.cache.path(self.filepath, self.filepath)
+        with open(path, 'wb') as fh:
+            pickle.dump({'version': 3}, fh)
+        with mock.patch('pickle.load') as load, \
+             mock.patch('pickle.loads') as loads:
+            self.assertIsNone(self.cache.load(self.filepath, self.filepath))
+        self.assertFalse(load.called or loads.called)
+
+
+class TestWriteAtomic(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'cache', 'results.json')
+
+    def test_written(self):
+        write_atomic(self.path, b'one')
+        write_atomic(self.path, b'two')
+        with open(self.path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'two')
+        self.assertEqual(os.listdir(os.path.dirname(self.path)),
+                         ['results.json'])
+
+    def test_failed_write_removed(self):
+        with mock.patch('os.replace', side_effect=OSError('full')):
+            with self.assertRaises(OSError):
+                write_atomic(self.path, b'one')
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), [])
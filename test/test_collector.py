@@ -0,0 +1,315 @@
+import gc
+import io
+import os
+import weakref
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from withspec.cache import CollectionCache
+from withspec.collector import WithSpecCollector
+from withspec.printer import Printer
+from withspec.registry import get_registry
+from withspec.runner import WithSpecRunner
+
+SPEC = b'''
+from withspec import describe
+
+with describe('Thing'):
+    def thing():
+        return 1
+
+    def test_thing(thing):
+        assert thing == 1
+
+    with describe('Child'):
+        def test_child(thing):
+            assert thing == 1
+'''
+
+
+class TestCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'spec.py')
+        with open(self.filepath, 'wb') as fh:
+            fh.write(SPEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def names(self, collector):
+        return [test.fullname() for test in collector.tests]
+
+    def test_registry_is_scoped_per_file(self):
+        before = len(get_registry().all_contexts())
+        collector = WithSpecCollector()
+        collector.collect_from_file(self.filepath)
+        collector.collect_from_file(self.filepath)
+        self.assertEqual(len(get_registry().all_contexts()), before)
+        self.assertEqual(len(collector.tests), 4)
+
+    def test_fixture_scopes(self):
+        spec = os.path.join(self.directory, 'scopes_spec.py')
+        def collect(outer, inner):
+            with open(spec, 'w') as fh:
+                fh.write('from withspec import describe, fixture\n'
+                         'with describe("Database"):\n'
+                         '    @fixture(scope="%s")\n'
+                         '    def engine():\n'
+                         '        return "engine"\n'
+                         '    @fixture(scope="%s")\n'
+                         '    def connection(engine):\n'
+                         '        return engine\n'
+                         '    def test_query(connection):\n'
+                         '        pass\n'
+                         '    def test_other(test):\n'
+                         '        pass\n' % (outer, inner))
+            collector = WithSpecCollector()
+            collector.collect_from_file(spec)
+            return dict((test.name, test) for test in collector.tests)
+        for outer, inner in (('session', 'context'), ('context', 'context'),
+                             ('context', 'test')):
+            collect(outer, inner)['test query'].run()
+        # Only the test using the fixture fails, when it is run
+        tests = collect('context', 'session')
+        tests['test other'].run()
+        with self.assertRaisesRegex(ValueError, 'session scoped fixture '
+                                    '`connection` cannot depend on `engine`'):
+            tests['test query'].run()
+        with self.assertRaises(ValueError):
+            collect('test', 'context')['test query'].run()
+
+    def test_cached_kinds_follow_their_context(self):
+        spec = os.path.join(self.directory, 'flip_spec.py')
+        other = (b'    with describe("B"):\n'
+                 b'        def other():\n'
+                 b'            return 2\n'
+                 b'        def test_b(other):\n'
+                 b'            pass\n')
+        with open(spec, 'wb') as fh:
+            fh.write(b'import os\n'
+                     b'from withspec import describe\n'
+                     b'if os.environ.get("WITHSPEC_FLIP"):\n' + other +
+                     b'with describe("A"):\n'
+                     b'    def value():\n'
+                     b'        return 1\n'
+                     b'    def test_a(value):\n'
+                     b'        pass\n'
+                     b'if not os.environ.get("WITHSPEC_FLIP"):\n' + other)
+        cache = CollectionCache(os.path.join(self.directory, 'cache'))
+        collector = WithSpecCollector(cache=cache)
+        collector.collect_from_file(spec)
+        # The same source, so the cached kinds are used, but the contexts
+        # are entered in another order
+        with mock.patch.dict(os.environ, {'WITHSPEC_FLIP': '1'}):
+            collector = WithSpecCollector(cache=cache)
+            collector.collect_from_file(spec)
+        self.assertEqual(self.names(collector), ['B test b', 'A test a'])
+
+    def test_shared_groups_are_visible_across_files(self):
+        shared = os.path.join(self.directory, 'shared_spec.py')
+        uses = os.path.join(self.directory, 'uses_spec.py')
+        with open(shared, 'wb') as fh:
+            fh.write(b'from withspec import shared\n'
+                     b'with shared("a widget"):\n'
+                     b'    def test_widget():\n'
+                     b'        pass\n')
+        with open(uses, 'wb') as fh:
+            fh.write(b'from withspec import describe, it_behaves_like\n'
+                     b'with describe("Gadget"):\n'
+                     b'    it_behaves_like("a widget")\n')
+        collector = WithSpecCollector()
+        collector.collect_from_file(shared)
+        collector.collect_from_file(uses)
+        self.assertEqual(self.names(collector),
+                         ['Gadget [a widget] test widget'])
+
+        # Not seen by another collector, which has a pending test for it
+        other = WithSpecCollector()
+        other.collect_from_file(uses)
+        self.assertEqual(self.names(other), ['Gadget a widget'])
+
+        collector.forget(shared)
+        collector.forget(uses)
+        collector.collect_from_file(uses)
+        self.assertEqual(self.names(collector), ['Gadget a widget'])
+        self.assertEqual([test.tags for test in collector.tests],
+                         [{'pending'}])
+
+    def test_shared_groups_defined_twice(self):
+        first = os.path.join(self.directory, 'first_spec.py')
+        second = os.path.join(self.directory, 'second_spec.py')
+        uses = os.path.join(self.directory, 'uses_spec.py')
+        for filepath in (first, second):
+            with open(filepath, 'wb') as fh:
+                fh.write(b'from withspec import shared\n'
+                         b'with shared("a widget"):\n'
+                         b'    def test_widget():\n'
+                         b'        pass\n')
+        with open(uses, 'wb') as fh:
+            fh.write(b'from withspec import describe, it_behaves_like\n'
+                     b'with describe("Gadget"):\n'
+                     b'    it_behaves_like("a widget")\n')
+        collector = WithSpecCollector()
+        collector.collect_from_file(first)
+        collector.collect_from_file(second)
+        # The second file still defines it
+        collector.forget(first)
+        collector.collect_from_file(uses)
+        self.assertEqual(self.names(collector),
+                         ['Gadget [a widget] test widget'])
+
+    def test_thread_safe(self):
+        uses = os.path.join(self.directory, 'threads_spec.py')
+        with open(uses, 'wb') as fh:
+            fh.write(b'from withspec import describe, tag\n'
+                     b'with describe("Safe", thread_safe=True):\n'
+                     b'    with describe("Child"):\n'
+                     b'        def test_safe(test):\n'
+                     b'            pass\n'
+                     b'with describe("Unsafe"):\n'
+                     b'    def test_unsafe(test):\n'
+                     b'        pass\n'
+                     b'    @tag("threadsafe")\n'
+                     b'    def test_tagged(test):\n'
+                     b'        pass\n')
+        collector = WithSpecCollector()
+        collector.collect_from_file(uses)
+        self.assertEqual([test.thread_safe() for test in collector.tests],
+                         [True, False, True])
+
+    def test_stream(self):
+        shared = os.path.join(self.directory, 'shared_spec.py')
+        with open(shared, 'wb') as fh:
+            fh.write(b'from withspec import describe, shared, '
+                     b'it_behaves_like\n'
+                     b'with shared("a widget"):\n'
+                     b'    def test_widget():\n'
+                     b'        pass\n'
+                     b'with describe("Gadget"):\n'
+                     b'    it_behaves_like("a widget")\n')
+        collector = WithSpecCollector()
+        batches = collector.stream([(shared, None), (self.filepath, None)])
+        tests = next(batches)
+        self.assertEqual([test.fullname() for test in tests],
+                         ['Gadget [a widget] test widget'])
+        self.assertEqual(collector.tests, [])
+        self.assertEqual(collector.files[shared].shared, {'a widget'})
+
+        # Nothing else holds on to them, though the shared group lives on
+        test = weakref.ref(tests[0])
+        context = weakref.ref(tests[0].context)
+        del tests
+        gc.collect()
+        self.assertIsNone(test())
+        self.assertIsNone(context())
+        self.assertEqual(len(next(batches)), 2)
+        self.assertEqual(list(batches), [])
+
+    def test_examples(self):
+        spec = os.path.join(self.directory, 'examples_spec.py')
+        with open(spec, 'wb') as fh:
+            fh.write(b'from withspec import describe, examples\n'
+                     b'seen = []\n'
+                     b'with describe("Sums"):\n'
+                     b'    def offset():\n'
+                     b'        return 10\n'
+                     b'    @examples([{"a": 1, "b": 2}, {"a": 3, "b": 4}])\n'
+                     b'    def test_sum(a, b, offset):\n'
+                     b'        seen.append(a + b + offset)\n'
+                     b'    @examples([(5,)], names=["a"], title="just {a}")\n'
+                     b'    def test_one(a):\n'
+                     b'        seen.append(a)\n')
+        collector = WithSpecCollector()
+        collector.collect_from_file(spec)
+        self.assertEqual(self.names(collector),
+                         ['Sums test sum [a=1, b=2]',
+                          'Sums test sum [a=3, b=4]',
+                          'Sums just 5'])
+        # Every row shares the one plan
+        first, second, third = collector.tests
+        self.assertIs(first.plan, second.plan)
+        for test in collector.tests:
+            test.run()
+        seen = first.actual.__globals__['seen']
+        self.assertEqual(seen, [13, 17, 5])
+
+    def test_examples_before_fixtures(self):
+        spec = os.path.join(self.directory, 'examples_spec.py')
+        with open(spec, 'wb') as fh:
+            fh.write(b'from withspec import describe, examples\n'
+                     b'seen = []\n'
+                     b'with describe("Sums"):\n'
+                     b'    def a():\n'
+                     b'        return 100\n'
+                     b'    def doubled(a):\n'
+                     b'        return a * 2\n'
+                     b'    def square(b):\n'
+                     b'        return b * b\n'
+                     b'    @examples([{"a": 1, "b": 2}])\n'
+                     b'    def test_sum(a, doubled, square):\n'
+                     b'        seen.append((a, doubled, square))\n')
+        collector = WithSpecCollector()
+        collector.collect_from_file(spec)
+        test, = collector.tests
+        test.run()
+        # The fixture named `a` is only seen by those depending on it,
+        # and a fixture can depend on the row
+        self.assertEqual(test.actual.__globals__['seen'], [(1, 200, 4)])
+
+    def test_malformed_examples(self):
+        spec = os.path.join(self.directory, 'examples_spec.py')
+        with open(spec, 'wb') as fh:
+            fh.write(b'from withspec import describe, examples\n'
+                     b'with describe("Rows"):\n'
+                     b'    @examples([{"a": 1}, {"b": 2}, 3])\n'
+                     b'    def test_mapping(a):\n'
+                     b'        pass\n'
+                     b'    @examples([(1,), (1, 2)], names=["a"])\n'
+                     b'    def test_sequence(a):\n'
+                     b'        pass\n'
+                     b'    @examples([(1,)], names=["a"], title="{b}")\n'
+                     b'    def test_title(a):\n'
+                     b'        pass\n'
+                     b'    @examples([3])\n'
+                     b'    def test_scalar(a):\n'
+                     b'        pass\n')
+        collector = WithSpecCollector()
+        collector.collect_from_file(spec)
+        self.assertEqual(self.names(collector),
+                         ['Rows test mapping [a=1]',
+                          "Rows test mapping [{'b': 2}]",
+                          'Rows test mapping [3]',
+                          'Rows test sequence [a=1]',
+                          'Rows test sequence [(1, 2)]',
+                          'Rows test title [(1,)]',
+                          'Rows test scalar [3]'])
+        printer = Printer(colour=False, detailed=True)
+        printer.output = io.StringIO()
+        runner = WithSpecRunner(hooks=[])
+        runner.run(collector.tests, printer)
+        self.assertEqual(runner.total, 7)
+        self.assertEqual([test.fullname() for test, output in runner.failed],
+                         self.names(collector)[1:3] +
+                         self.names(collector)[4:])
+
+    def test_async_generator_fixture(self):
+        spec = os.path.join(self.directory, 'async_spec.py')
+        with open(spec, 'wb') as fh:
+            fh.write(b'from withspec import describe\n'
+                     b'calls = []\n'
+                     b'with describe("Connection"):\n'
+                     b'    async def connection():\n'
+                     b'        calls.append("open")\n'
+                     b'        yield "connection"\n'
+                     b'        calls.append("close")\n'
+                     b'    async def test_query(connection):\n'
+                     b'        calls.append(connection)\n')
+        collector = WithSpecCollector()
+        collector.collect_from_file(spec)
+        test, = collector.tests
+        test.run()
+        self.assertEqual(test.actual.__globals__['calls'],
+                         ['open', 'connection', 'close'])
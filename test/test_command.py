@@ -0,0 +1,114 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from io import StringIO
+from unittest import mock
+from withspec.command import make_printer, process_argv, run_specs, \
+                             run_tests
+from withspec.printer import Printer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestImports(unittest.TestCase):
+
+    def test_optional_subsystems_are_imported_lazily(self):
+        # Checked in a fresh interpreter, as other tests import them
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, withspec.command\n'
+             'for name in ("asyncio", "multiprocessing", "subprocess",\n'
+             '             "concurrent.futures", "xml.sax.saxutils"):\n'
+             '    print(name, name in sys.modules)\n'],
+            cwd=ROOT, universal_newlines=True)
+        self.assertEqual(output.split(),
+                         ['asyncio', 'False',
+                          'multiprocessing', 'False',
+                          'subprocess', 'False',
+                          'concurrent.futures', 'False',
+                          'xml.sax.saxutils', 'False'])
+
+
+class TestReporterOptions(unittest.TestCase):
+
+    def test_printer_gives_reporter_stdout(self):
+        config = process_argv(['--json', '-', '--buffer', 'off'], {})
+        self.assertIs(make_printer(config).output, sys.stderr)
+        config = process_argv(['--json', 'results.json'], {})
+        self.assertIs(make_printer(config).output, sys.stdout)
+
+    def test_one_reporter_on_stdout(self):
+        with self.assertRaises(SystemExit), \
+             mock.patch('sys.stderr', StringIO()):
+            process_argv(['--json', '-', '--junit-xml', '-'], {})
+
+
+class FakeTest(object):
+    tags = frozenset()
+    name = 'test'
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def fullname(self):
+        return 'Fake %s' % self.name
+
+    def definition(self):
+        return None
+
+    def filename(self):
+        return __file__
+
+    def parents(self):
+        return []
+
+    def run(self, scopes=None, timings=None):
+        if self.error is not None:
+            raise self.error()
+
+
+class TestRunTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_reporters_closed_when_interrupted(self):
+        path = os.path.join(self.directory, 'results.xml')
+        config = process_argv(['--junit-xml', path, '--no-cache',
+                               '--order', 'defined'], {})
+        printer = Printer(colour=False)
+        printer.output = StringIO()
+        with self.assertRaises(KeyboardInterrupt):
+            run_tests(config, [FakeTest(), FakeTest(KeyboardInterrupt)],
+                      printer)
+        with open(path) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[-1], '</testsuite>')
+        self.assertIn('tests="1"', lines[1])
+
+
+class TestSummarise(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_failed_names_not_formatted(self):
+        with open(os.path.join(self.directory, 'spec.py'), 'wb') as fh:
+            fh.write(b'from withspec import describe, examples\n'
+                     b'with describe("Rows"):\n'
+                     b'    @examples([{"row": {"y": 2}}])\n'
+                     b'    def test_checks_row(test, row):\n'
+                     b'        test(row).equal({})\n')
+        config = process_argv(['--no-cache', self.directory], {})
+        printer = Printer(colour=False)
+        printer.output = StringIO()
+        run_specs(config, printer)
+        output = printer.output.getvalue()
+        summary = output[output.index('Failed Tests:'):]
+        self.assertIn("spec.py:3 # Rows test checks row [row={'y': 2}]",
+                      summary)
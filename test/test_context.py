@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from withspec.collector import WithSpecCollector
+from withspec.context import Context
+
+SPEC = b'''
+from withspec import describe
+
+with describe('Outer'):
+    def db():
+        return 'outer db'
+
+    def connection(db):
+        return 'connection to ' + db
+
+    def widget(connection):
+        return 'widget'
+
+    def test_outer(connection):
+        assert connection == 'connection to outer db', connection
+
+    with describe('Inner'):
+        def db():
+            return 'inner db'
+
+        def test_first(connection):
+            assert connection == 'connection to inner db', connection
+
+        def test_second(connection):
+            assert connection == 'connection to inner db', connection
+'''
+
+
+class TestContextStacks(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        filepath = os.path.join(self.directory, 'spec.py')
+        with open(filepath, 'wb') as fh:
+            fh.write(SPEC)
+        collector = WithSpecCollector()
+        collector.collect_from_file(filepath)
+        self.tests = dict((test.fullname(), test) for test in collector.tests)
+        self.inner = self.tests['Outer Inner test first'].context
+        self.outer = self.inner.parent
+
+    def names(self, elements):
+        return [(element.context.name, element.name) for element in elements]
+
+    def test_child_overrides_parent_fixture(self):
+        # The parent's connection is given the child's db
+        stack = self.tests['Outer Inner test first'].stack
+        self.assertEqual(self.names(stack),
+                         [('Inner', 'db'), ('Outer', 'connection'),
+                          ('Inner', 'test first')])
+        self.assertEqual(self.names(self.tests['Outer test outer'].stack),
+                         [('Outer', 'db'), ('Outer', 'connection'),
+                          ('Outer', 'test outer')])
+        self.assertIs(self.outer.fixture_index()['db'],
+                      self.outer.elements['fixtures']['db'])
+        for test in self.tests.values():
+            test.run()
+
+    def test_siblings_share_a_stack(self):
+        self.inner.forget_stacks()
+        with mock.patch.object(Context, 'fixture_resolver', autospec=True,
+                               side_effect=Context.fixture_resolver) \
+                as resolver:
+            first = self.tests['Outer Inner test first'].build()
+            second = self.tests['Outer Inner test second'].build()
+        self.assertEqual(resolver.call_count, 1)
+        self.assertIs(self.inner.stack_for(('connection',)),
+                      self.inner.stack_for(('connection',)))
+        self.assertEqual(first.stack[:-1], second.stack[:-1])
+
+    def test_forgotten_when_test_becomes_fixture(self):
+        # widget takes an argument and nothing uses it, so it's a test
+        self.assertNotIn('widget', self.outer.fixture_index())
+        before, after = self.inner.stack_for(('widget',))
+        self.assertEqual(before, ())
+        # Until a shared group, say, turns out to use it
+        self.outer.resolve_fixtures({'widget'})
+        self.assertIn('widget', self.outer.fixture_index())
+        before, after = self.inner.stack_for(('widget',))
+        self.assertEqual(self.names(before),
+                         [('Inner', 'db'), ('Outer', 'connection'),
+                          ('Outer', 'widget')])
@@ -0,0 +1,118 @@
+import os
+import sys
+import shutil
+import builtins
+import importlib
+import tempfile
+import unittest
+from withspec.deps import DependencyMap, ImportTracker, git_changed_files
+
+PROJECT = {
+    'pkg/__init__.py': '',
+    'pkg/models.py': 'from . import base\n',
+    'pkg/base.py': '',
+    'pkg/views.py': 'import importlib\n'
+                    'importlib.import_module(".plugin", "pkg")\n',
+    'pkg/plugin.py': '',
+    'pkg/unused.py': '',
+}
+
+
+class TestImportTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        for name, source in PROJECT.items():
+            filepath = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(filepath, 'w') as fh:
+                fh.write(source)
+        sys.path.insert(0, self.root)
+        self.tracker = ImportTracker(self.root)
+
+    def tearDown(self):
+        sys.path.remove(self.root)
+        for name in list(sys.modules):
+            if name == 'pkg' or name.startswith('pkg.'):
+                del sys.modules[name]
+        shutil.rmtree(self.root)
+
+    def spec(self, source):
+        '''Run source as a spec file, returning the files it depends on'''
+        namespace = {'__name__': '__spec__'}
+        with self.tracker(namespace) as imported:
+            exec(source, namespace)
+        return sorted(os.path.relpath(filename, self.root)
+                      for filename in self.tracker.files(imported))
+
+    def test_relative_imports(self):
+        self.assertEqual(self.spec('from pkg import models\n'),
+                         ['pkg/__init__.py', 'pkg/base.py',
+                          'pkg/models.py'])
+
+    def test_import_module(self):
+        self.assertEqual(self.spec('import importlib\n'
+                                   'importlib.import_module("pkg.views")\n'),
+                         ['pkg/__init__.py', 'pkg/plugin.py',
+                          'pkg/views.py'])
+
+    def test_already_imported(self):
+        self.spec('from pkg import models\n')
+        # Not executed again, but still depended on
+        self.assertEqual(self.spec('import pkg.models\n'),
+                         ['pkg/__init__.py', 'pkg/base.py',
+                          'pkg/models.py'])
+
+    def test_hooks_removed(self):
+        self.spec('import pkg\n')
+        self.assertIsNot(builtins.__import__, self.tracker.hook)
+        self.assertIsNot(importlib.import_module, self.tracker.import_module)
+
+    def test_reload_order(self):
+        self.spec('from pkg import models\n')
+        self.assertEqual(self.tracker.reload_order(['pkg.base']),
+                         ['pkg.base', 'pkg.models'])
+
+
+class TestGitChangedFiles(unittest.TestCase):
+
+    def test_not_a_repository(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            with self.assertRaises(ValueError):
+                git_changed_files('HEAD')
+        finally:
+            os.chdir(cwd)
+
+
+class TestDependencyMap(unittest.TestCase):
+
+    def setUp(self):
+        self.dependencies = DependencyMap('/nowhere/dependencies.json')
+        self.dependencies.update({
+            '/project/spec/views.py': ['/project/app/views.py',
+                                       '/project/app/models.py'],
+            '/project/spec/plain.py': [],
+        })
+        self.files = [('/project/spec/views.py', None),
+                      ('/project/spec/plain.py', None),
+                      ('/project/spec/new.py', None)]
+
+    def select(self, changed):
+        return [filepath for filepath, line in
+                self.dependencies.select(self.files, changed)]
+
+    def test_imported_file_changed(self):
+        self.assertEqual(self.select(['/project/app/models.py']),
+                         ['/project/spec/views.py', '/project/spec/new.py'])
+
+    def test_spec_file_changed(self):
+        self.assertEqual(self.select(['/project/spec/plain.py']),
+                         ['/project/spec/plain.py', '/project/spec/new.py'])
+
+    def test_unrelated_file_changed(self):
+        self.assertEqual(self.select(['/project/README.md']),
+                         ['/project/spec/new.py'])
@@ -0,0 +1,133 @@
+import unittest
+from withspec.decorators import fixture
+from withspec import elements
+from withspec.elements import FixtureElement, ScopedFixtures
+
+
+class FakeTest(object):
+    def __init__(self, *stack, **kwargs):
+        self.stack = stack
+        self.awaits = kwargs.get('awaits', ())
+
+
+class TestScopedFixtures(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.scopes = ScopedFixtures()
+
+    def element(self, func):
+        return FixtureElement(key=func.__name__, name=func.__name__,
+                              actual=func, context=None)
+
+    def test_context_scope(self):
+        @fixture(scope='context')
+        def schema():
+            self.calls.append('up')
+            yield 'schema'
+            self.calls.append('down')
+        element = self.element(schema)
+        first, second = FakeTest(element), FakeTest(element)
+        self.scopes.expect([first, second])
+
+        self.assertEqual(self.scopes.value(element, []), 'schema')
+        self.scopes.finished(first)
+        self.assertEqual(self.scopes.value(element, []), 'schema')
+        self.assertEqual(self.calls, ['up'])
+        self.scopes.finished(second)
+        self.assertEqual(self.calls, ['up', 'down'])
+
+    def test_session_scope(self):
+        @fixture(scope='session')
+        def corpus():
+            self.calls.append('up')
+            return 'corpus'
+        element = self.element(corpus)
+        test = FakeTest(element)
+        self.scopes.expect([test])
+        self.scopes.value(element, [])
+        self.scopes.finished(test)
+        self.scopes.value(element, [])
+        self.assertEqual(self.calls, ['up'])
+        self.scopes.close()
+        self.assertEqual(self.scopes.values, {})
+
+    def test_async_generator(self):
+        @fixture(scope='context')
+        async def server():
+            self.calls.append('up')
+            yield 'server'
+            self.calls.append('down')
+        element = self.element(server)
+        test = FakeTest(element)
+        self.scopes.expect([test])
+        value = self.scopes.loop.run(self.scopes.value_async(element, []))
+        self.assertEqual(value, 'server')
+        self.scopes.finished(test)
+        self.assertEqual(self.calls, ['up', 'down'])
+        self.scopes.close()
+        self.assertIsNone(self.scopes.loop.loop)
+
+    def test_loop_started_when_expecting_coroutines(self):
+        self.scopes.expect([FakeTest()])
+        self.assertIsNone(self.scopes.loop.loop)
+        self.scopes.expect([FakeTest(awaits=frozenset([0]))])
+        self.assertIsNotNone(self.scopes.loop.loop)
+        self.scopes.close()
+
+    def test_unknown_scope(self):
+        with self.assertRaises(ValueError):
+            fixture(scope='module')
+
+
+class TestGeneratorFixtures(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def run_test(self, fixture, test):
+        fixture = FixtureElement(key=fixture.__name__, name=fixture.__name__,
+                                 actual=fixture, context=None)
+        test = elements.TestElement(key=test.__name__, name=test.__name__,
+                                    actual=test, context=None)
+        test.stack = (fixture, test)
+        test.compile()
+        test.run()
+
+    def test_generator(self):
+        def plain():
+            self.calls.append('up')
+            yield 5
+            self.calls.append('down')
+        def test_plain(plain):
+            self.calls.append(plain)
+        self.run_test(plain, test_plain)
+        self.assertEqual(self.calls, ['up', 5, 'down'])
+
+    def test_generator_from_coroutine(self):
+        def plain():
+            yield 5
+            self.calls.append('down')
+        async def test_plain(plain):
+            self.calls.append(plain)
+        self.run_test(plain, test_plain)
+        self.assertEqual(self.calls, [5, 'down'])
+
+    def test_async_generator(self):
+        async def server():
+            yield 'server'
+            self.calls.append('down')
+        async def test_server(server):
+            self.calls.append(server)
+        self.run_test(server, test_server)
+        self.assertEqual(self.calls, ['server', 'down'])
+
+    def test_torn_down_when_failed(self):
+        def plain():
+            yield 5
+            self.calls.append('down')
+        def test_plain(plain):
+            raise AssertionError('failed')
+        with self.assertRaises(AssertionError):
+            self.run_test(plain, test_plain)
+        self.assertEqual(self.calls, ['down'])
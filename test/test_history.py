@@ -0,0 +1,73 @@
+import unittest
+from withspec.history import History, shard_files
+
+
+class FakeTest(object):
+    def __init__(self, name, line):
+        self.name = name
+        self.line = line
+
+    def definition(self):
+        return '/project/spec/things.py:%d' % self.line
+
+    def spec_file(self):
+        return '/project/spec/things.py'
+
+    def fullname(self):
+        return 'Things %s' % self.name
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = History('/nowhere/results.json')
+        self.slow = FakeTest('slow', 1)
+        self.quick = FakeTest('quick', 2)
+        self.broken = FakeTest('broken', 3)
+        self.new = FakeTest('new', 4)
+        self.history.record(self.slow, 'passed', 2.0)
+        self.history.record(self.quick, 'passed', 0.5)
+        self.history.record(self.broken, 'failed', 1.0)
+        self.tests = [self.slow, self.quick, self.broken, self.new]
+
+    def test_failed_first_then_quickest(self):
+        self.history.order(self.tests)
+        self.assertEqual(self.tests, [self.broken, self.new,
+                                      self.quick, self.slow])
+
+    def test_failed(self):
+        self.assertEqual(self.history.failed(self.tests), [self.broken])
+
+    def test_only_run_tests_recorded(self):
+        self.history.record(self.new, 'skipped', None)
+        self.history.record(self.broken, 'pending', None)
+        self.assertEqual(self.history.failed(self.tests), [self.broken])
+
+
+class TestShardFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.files = [('/spec/%s.py' % name, None)
+                      for name in ('a', 'b', 'c', 'd', 'e')]
+
+    def names(self, files):
+        return ''.join(filepath[6] for filepath, line in files)
+
+    def test_round_robin(self):
+        self.assertEqual([self.names(shard_files(self.files, index, 2))
+                          for index in range(2)], ['ace', 'bd'])
+
+    def test_balanced_by_duration(self):
+        durations = {'/spec/a.py': 10.0, '/spec/b.py': 6.0,
+                     '/spec/c.py': 3.0, '/spec/d.py': 1.0}
+        # e is assumed to take the average, 5.0
+        self.assertEqual([self.names(shard_files(self.files, index, 2,
+                                                 durations))
+                          for index in range(2)], ['ac', 'bde'])
+
+    def test_file_durations(self):
+        history = History('/nowhere/results.json')
+        history.record(FakeTest('one', 1), 'passed', 1.0)
+        history.record(FakeTest('two', 2), 'failed', 2.0)
+        self.assertEqual(history.file_durations(),
+                         {'/project/spec/things.py': 3.0})
@@ -0,0 +1,154 @@
+import linecache
+import logging
+import os
+import sys
+import unittest
+from io import StringIO
+from traceback import FrameSummary, extract_tb
+import withspec
+from withspec.hooks import CapturedOutput, LogHook, StdOutHook, \
+                           TraceBackHook
+
+WITHSPEC = os.path.join(os.path.dirname(withspec.__file__), 'runner.py')
+
+
+class FakeTest(object):
+    def filename(self):
+        return __file__
+
+
+def fail():
+    raise ValueError('failed')
+
+
+def failing_generator():
+    '''Catches a failure, then moves on past where it was raised'''
+    try:
+        fail()
+    except ValueError:
+        yield sys.exc_info()
+    yield None
+
+
+def eager(testfile, bt, exclude):
+    '''The traceback as formatted straight away'''
+    lines = []
+    seen_testfile = False
+    for filename, lineno, name, line in reversed(extract_tb(bt)):
+        if seen_testfile and exclude is not None and \
+           filename.startswith(exclude):
+            break
+        if filename == testfile:
+            seen_testfile = True
+        lines.append('# %s:%d:in %s' % (filename, lineno, name))
+    return lines
+
+
+class TestCapturedOutput(unittest.TestCase):
+
+    def test_sections(self):
+        out, err = StringIO(), StringIO()
+        out.write('  first  \nsecond\n')
+        err.write('oops\n')
+        output = CapturedOutput(('>> stdout <<', out), ('>> stderr <<', err))
+        self.assertEqual(list(output), ['>> stdout <<', 'first', 'second',
+                                        '>> stderr <<', 'oops'])
+
+    def test_read_each_time(self):
+        buffer = StringIO()
+        buffer.write('one\n')
+        output = CapturedOutput(('>> logs <<', buffer))
+        self.assertEqual(list(output), ['>> logs <<', 'one'])
+        self.assertEqual(list(output), ['>> logs <<', 'one'])
+
+
+class TestStdOutHook(unittest.TestCase):
+
+    def setUp(self):
+        self.hook = StdOutHook({})
+
+    def test_nothing_written(self):
+        self.hook.before(FakeTest())
+        self.assertIsNone(self.hook.after(FakeTest(), None, None, None))
+
+    def test_written(self):
+        self.hook.before(FakeTest())
+        print('hello')
+        sys.stderr.write('world\n')
+        output = self.hook.after(FakeTest(), None, None, None)
+        self.assertIs(sys.stdout, self.hook.stdout)
+        self.assertEqual(list(output), ['>> stdout <<', 'hello',
+                                        '>> stderr <<', 'world'])
+
+    def test_only_stderr(self):
+        self.hook.before(FakeTest())
+        sys.stderr.write('world\n')
+        output = self.hook.after(FakeTest(), None, None, None)
+        self.assertEqual(list(output), ['>> stderr <<', 'world'])
+
+
+class TestLogHook(unittest.TestCase):
+
+    def setUp(self):
+        self.hook = LogHook({})
+
+    def test_nothing_logged(self):
+        self.hook.before(FakeTest())
+        self.assertIsNone(self.hook.after(FakeTest(), None, None, None))
+
+    def test_logged(self):
+        level = logging.getLogger().level
+        self.hook.before(FakeTest())
+        logging.getLogger('thing').debug('hello')
+        output = self.hook.after(FakeTest(), None, None, None)
+        self.assertEqual(list(output), ['>> logs <<',
+                                        'DEBUG [thing] hello'])
+        self.assertEqual(logging.getLogger().level, level)
+        self.assertNotIn(self.hook.handler, logging.getLogger().handlers)
+
+
+class TestTraceBackHook(unittest.TestCase):
+
+    def setUp(self):
+        self.hook = TraceBackHook({'backtrace': False})
+
+    def test_passed(self):
+        self.assertIsNone(self.hook.after(FakeTest(), None, None, None))
+
+    def test_matches_eager(self):
+        try:
+            fail()
+        except ValueError:
+            exc, exv, bt = sys.exc_info()
+        expected = eager(__file__, bt, self.hook.exclude)
+        output = self.hook.after(FakeTest(), exc, exv, bt)
+        self.assertEqual(list(output), expected)
+        self.assertEqual(expected[0].split(':in ')[1], 'fail')
+
+    def test_frames_moved_on(self):
+        generator = failing_generator()
+        exc, exv, bt = next(generator)
+        expected = eager(__file__, bt, self.hook.exclude)
+        output = self.hook.after(FakeTest(), exc, exv, bt)
+        # Resumed, as a generator fixture is to tear down
+        next(generator)
+        generator.close()
+        del bt
+        linecache.clearcache()
+        self.assertEqual(list(output), expected)
+
+    def test_withspec_frames_excluded(self):
+        frames = [FrameSummary(WITHSPEC, 10, 'run', lookup_line=False),
+                  FrameSummary(__file__, 20, 'test_thing', lookup_line=False),
+                  FrameSummary(WITHSPEC, 30, 'equal', lookup_line=False)]
+        self.assertEqual(list(self.hook.format(__file__, frames)),
+                         ['# %s:30:in equal' % WITHSPEC,
+                          '# %s:20:in test_thing' % __file__])
+
+    def test_backtrace(self):
+        hook = TraceBackHook({'backtrace': True})
+        frames = [FrameSummary(WITHSPEC, 10, 'run', lookup_line=False),
+                  FrameSummary(__file__, 20, 'test_thing', lookup_line=False)]
+        self.assertEqual(list(hook.format(__file__, frames)),
+                         ['# %s:20:in test_thing' % __file__,
+                          '# %s:10:in run' % WITHSPEC])
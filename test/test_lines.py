@@ -0,0 +1,37 @@
+import unittest
+from withspec.lines import LineIndex
+
+SOURCE = '''
+with describe('Thing'):
+    @fixture
+    def thing():
+        return 1
+
+    def test_thing(thing):
+        pass
+
+    with context('child'):
+        def test_child():
+            pass
+'''
+
+
+class TestLineIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = LineIndex(SOURCE)
+
+    def test_innermost_first(self):
+        self.assertEqual(self.index.enclosing(11), [(11, 12, 'def'),
+                                                   (10, 12, 'with'),
+                                                   (2, 12, 'with')])
+
+    def test_decorators_start_a_function(self):
+        self.assertEqual(self.index.enclosing(3)[0], (3, 5, 'def'))
+
+    def test_between_blocks(self):
+        self.assertEqual(self.index.enclosing(9), [(2, 12, 'with')])
+
+    def test_outside_any_block(self):
+        self.assertEqual(self.index.enclosing(1), [])
+        self.assertEqual(self.index.following(1)[0], (2, 12, 'with'))
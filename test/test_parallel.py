@@ -0,0 +1,212 @@
+import contextlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from withspec.collector import WithSpecCollector
+from withspec.command import process_argv
+from withspec.history import History
+from withspec.parallel import ParallelRunner, RemoteTest, split_files, \
+    worker_configs
+from withspec.printer import Printer
+
+SPECS = {
+    'a_spec.py': b'from withspec import describe\n'
+                 b'with describe("A"):\n'
+                 b'    def test_passes(test):\n'
+                 b'        pass\n'
+                 b'    def test_fails(test):\n'
+                 b'        assert False\n',
+    'b_spec.py': b'from withspec import describe\n'
+                 b'with describe("B"):\n'
+                 b'    def test_one(test):\n'
+                 b'        pass\n'
+                 b'    def test_two(test):\n'
+                 b'        pass\n',
+    'c_spec.py': b'from withspec import describe\n'
+                 b'with describe("C"):\n'
+                 b'    def test_three(test):\n'
+                 b'        pass\n',
+}
+
+
+class TestSplitFiles(unittest.TestCase):
+    files = [('spec_%d.py' % i, None) for i in range(7)]
+
+    def test_round_robin(self):
+        shares = split_files(list(reversed(self.files)), 3)
+        self.assertEqual([[filepath for filepath, line in share]
+                          for share in shares],
+                         [['spec_0.py', 'spec_3.py', 'spec_6.py'],
+                          ['spec_1.py', 'spec_4.py'],
+                          ['spec_2.py', 'spec_5.py']])
+
+    def test_no_empty_shares(self):
+        self.assertEqual(len(split_files(self.files[:2], 4)), 2)
+
+    def test_seed_decides_the_shares(self):
+        shares = split_files(self.files, 3, seed=1234)
+        self.assertEqual(shares, split_files(list(reversed(self.files)), 3,
+                                             seed=1234))
+        self.assertNotEqual(shares, split_files(self.files, 3))
+        self.assertEqual(sorted(sum(shares, [])), self.files)
+
+    def test_worker_seeds(self):
+        config = {'order': 'random', 'seed': 1234}
+        seeds = [worker['seed'] for worker in worker_configs(config, 4)]
+        self.assertEqual(seeds, [worker['seed']
+                                 for worker in worker_configs(config, 4)])
+        self.assertEqual(len(set(seeds)), 4)
+        config = {'order': 'defined', 'seed': 1234}
+        self.assertEqual(worker_configs(config, 2), [config, config])
+
+
+class SpecDirectory(object):
+
+    def write_specs(self, specs):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.files = []
+        for name, source in sorted(specs.items()):
+            filepath = os.path.join(self.directory, name)
+            with open(filepath, 'wb') as fh:
+                fh.write(source)
+            self.files.append((filepath, None))
+
+
+class TestRemoteTest(SpecDirectory, unittest.TestCase):
+
+    def setUp(self):
+        self.write_specs({'a_spec.py': b'from withspec import describe, tag\n'
+                                       b'with describe("A"):\n'
+                                       b'    with describe("B"):\n'
+                                       b'        @tag("slow")\n'
+                                       b'        def test_it(test):\n'
+                                       b'            pass\n'})
+        collector = WithSpecCollector()
+        collector.collect_from_file(self.files[0][0])
+        self.test = collector.tests[0]
+
+    def remote(self, status, definition=False):
+        return pickle.loads(pickle.dumps(RemoteTest(self.test, status,
+                                                    definition)))
+
+    def test_marshalled(self):
+        remote = self.remote('passed')
+        self.assertEqual(remote.name, 'test it')
+        self.assertEqual(remote.fullname(), 'A B test it')
+        self.assertEqual(remote.tags, {'slow'})
+        self.assertEqual(remote.spec_file(), self.test.spec_file())
+        self.assertEqual([parent.name for parent in remote.parents()],
+                         ['A', 'B'])
+        self.assertIsNone(remote.definition())
+
+    def test_parents_compare_by_path(self):
+        first, second = self.remote('passed'), self.remote('passed')
+        self.assertEqual(first.parents(), second.parents())
+        self.assertNotEqual(first.parents()[0], first.parents()[1])
+
+    def test_failures_keep_their_definition(self):
+        self.assertEqual(self.remote('failed').definition(),
+                         self.test.definition())
+        self.assertEqual(self.remote('passed', True).definition(),
+                         self.test.definition())
+
+
+class TestParallelRunner(SpecDirectory, unittest.TestCase):
+
+    def setUp(self):
+        self.write_specs(SPECS)
+        self.cache_dir = os.path.join(self.directory, 'cache')
+
+    def run_specs(self, *argv):
+        config = process_argv(['--cache-dir', self.cache_dir] +
+                              list(argv) + [self.directory], {})
+        printer = Printer(colour=False, detailed=True)
+        printer.output = io.StringIO()
+        runner = ParallelRunner(hooks=[],
+                                fail_fast=config['fail_fast'],
+                                history=History.load(self.cache_dir),
+                                jobs=config['jobs'],
+                                config=config)
+        runner.run(list(self.files), printer)
+        runner.close()
+        return runner
+
+    def names(self, tests):
+        return sorted(test.fullname() for test in tests)
+
+    def test_last_failed(self):
+        runner = self.run_specs('--jobs', '2')
+        self.assertEqual(runner.total, 5)
+        self.assertEqual(self.names(test for test, output in runner.failed),
+                         ['A test fails'])
+
+        # Workers without a failure in their share run nothing
+        runner = self.run_specs('--jobs', '2', '--last-failed')
+        self.assertEqual(runner.total, 1)
+        self.assertEqual(len(runner.failed), 1)
+
+    def test_last_failed_none_failed(self):
+        os.remove(self.files.pop(0)[0])
+        self.run_specs('--jobs', '2')
+        with self.assertLogs('withspec.parallel', 'WARNING'):
+            runner = self.run_specs('--jobs', '3', '--last-failed')
+        self.assertEqual(runner.total, 3)
+
+    def test_results(self):
+        runner = self.run_specs('--jobs', '2', '--order', 'defined')
+        self.assertEqual(runner.collected, 5)
+        self.assertEqual(runner.total, 5)
+        self.assertEqual(len(runner.errors), 0)
+        self.assertEqual(sorted(runner.imports),
+                         sorted(filepath for filepath, line in self.files))
+        (test, output), = runner.failed
+        self.assertIsInstance(test, RemoteTest)
+        self.assertEqual(test.definition(),
+                         '%s:5' % os.path.join(self.directory, 'a_spec.py'))
+
+    def test_fail_fast_aborts_other_workers(self):
+        self.write_specs({
+            'a_spec.py': b'from withspec import describe\n'
+                         b'with describe("A"):\n'
+                         b'    def test_fails(test):\n'
+                         b'        assert False\n',
+            'b_spec.py': b'import time\n'
+                         b'from withspec import describe\n'
+                         b'with describe("B"):\n'
+                         b'    def test_slow(test):\n'
+                         b'        time.sleep(1)\n' +
+                         b''.join(b'    def test_%d(test):\n'
+                                  b'        pass\n' % i
+                                  for i in range(10)),
+        })
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        runner = self.run_specs('--jobs', '2', '--order', 'defined',
+                                '--fail-fast')
+        self.assertEqual(len(runner.failed), 1)
+        self.assertEqual(runner.total, 12)
+        self.assertGreaterEqual(len(runner.skipped), 10)
+
+    def test_worker_crash(self):
+        self.write_specs({
+            'a_spec.py': SPECS['c_spec.py'],
+            'b_spec.py': b'import os\n'
+                         b'os._exit(3)\n',
+        })
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        with self.assertRaises(RuntimeError) as raised, \
+             contextlib.redirect_stderr(io.StringIO()):
+            self.run_specs('--jobs', '2')
+        self.assertEqual(str(raised.exception), '1 of 2 workers failed')
+
+    def test_worker_error(self):
+        self.write_specs({'a_spec.py': b'raise ValueError("broken")\n'})
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        stderr = io.StringIO()
+        with self.assertRaises(RuntimeError), \
+             contextlib.redirect_stderr(stderr):
+            self.run_specs('--jobs', '2')
+        self.assertIn('ValueError: broken', stderr.getvalue())
@@ -0,0 +1,64 @@
+import io
+import unittest
+from withspec.printer import Printer, BufferedPrinter
+
+
+class SlowOutput(io.StringIO):
+    def __init__(self):
+        super(SlowOutput, self).__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super(SlowOutput, self).write(text)
+
+
+class TestPrinter(unittest.TestCase):
+
+    def test_line_is_one_write(self):
+        printer = Printer(colour=True)
+        printer.output = SlowOutput()
+        printer.red('failed {}', 'badly', level=2)
+        self.assertEqual(printer.output.writes, 1)
+        self.assertEqual(printer.output.getvalue(),
+                         '    \033[31mfailed badly\033[0m\n')
+
+
+class TestBufferedPrinter(unittest.TestCase):
+
+    def printer(self, **kwargs):
+        printer = BufferedPrinter(colour=False, detailed=False, **kwargs)
+        printer.output = SlowOutput()
+        self.addCleanup(printer.close)
+        return printer
+
+    def test_batches(self):
+        printer = self.printer(interval=60)
+        for i in range(100):
+            printer.line('line {:d}', i)
+        self.assertEqual(printer.output.writes, 0)
+        printer.close()
+        self.assertEqual(printer.output.writes, 1)
+        self.assertEqual(printer.output.getvalue().splitlines(),
+                         ['line %d' % i for i in range(100)])
+
+    def test_limit(self):
+        printer = self.printer(interval=60, limit=10)
+        printer.line('12345')
+        self.assertEqual(printer.output.writes, 0)
+        printer.line('67890')
+        self.assertEqual(printer.output.getvalue(), '12345\n67890\n')
+
+    def test_failures_written_straight_away(self):
+        printer = self.printer(interval=60)
+        printer.line('.', new_line=False)
+        printer.error(None)
+        self.assertEqual(printer.output.getvalue(), '.F')
+
+    def test_background(self):
+        printer = self.printer(interval=0.01, background=True)
+        printer.line('.', new_line=False)
+        printer.writer.join(0.2)  # Still running, so this only waits
+        self.assertEqual(printer.output.getvalue(), '.')
+        printer.close()
+        self.assertFalse(printer.writer.is_alive())
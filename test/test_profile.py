@@ -0,0 +1,178 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from withspec.collector import WithSpecCollector
+from withspec.command import process_argv, run_specs
+from withspec.printer import Printer
+from withspec.profile import Profile
+from withspec.runner import WithSpecRunner
+
+
+class FakeContext(object):
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+
+
+class FakeElement(object):
+    def __init__(self, context, name):
+        self.context = context
+        self.name = name
+
+
+class FixtureElement(FakeElement):
+    pass
+
+
+class FakeTest(FakeElement):
+    def fullname(self):
+        return '%s %s' % (self.context.name, self.name)
+
+    def definition(self):
+        return 'spec.py:1'
+
+
+class TestProfileTotals(unittest.TestCase):
+
+    def setUp(self):
+        self.thing = FakeContext('Thing')
+        self.child = FakeContext('Child', self.thing)
+        self.fixture = FixtureElement(self.thing, 'database')
+
+    def add(self, profile, context, name, wall):
+        test = FakeTest(context, name)
+        profile.add(test, wall, wall / 2, [(self.fixture, 0.5, 0.25),
+                                           (test, wall - 0.5, 0.0)])
+
+    def test_slowest_tests_kept(self):
+        profile = Profile(2)
+        for wall in (1.0, 3.0, 2.0, 0.5):
+            self.add(profile, self.thing, 'test %s' % wall, wall)
+        self.assertEqual(sorted(profile.tests, reverse=True),
+                         [(3.0, 1.5, 'Thing test 3.0', 'spec.py:1'),
+                          (2.0, 1.0, 'Thing test 2.0', 'spec.py:1')])
+
+    def test_totals(self):
+        profile = Profile(5)
+        self.add(profile, self.thing, 'test one', 1.0)
+        self.add(profile, self.child, 'test two', 2.0)
+        # The test's own step isn't an element
+        self.assertEqual(profile.elements,
+                         {('Thing', 'fixture', 'database'): [2, 1.0, 0.5]})
+        self.assertEqual(profile.contexts,
+                         {'Thing': [1, 1.0, 0.5],
+                          'Thing Child': [1, 2.0, 1.0]})
+
+    def test_merge(self):
+        first, second = Profile(2), Profile(2)
+        self.add(first, self.thing, 'test one', 1.0)
+        self.add(first, self.thing, 'test two', 2.0)
+        self.add(second, self.thing, 'test three', 3.0)
+        first.merge(second)
+        self.assertEqual(sorted(name for wall, cpu, name, definition
+                                in first.tests),
+                         ['Thing test three', 'Thing test two'])
+        self.assertEqual(first.elements[('Thing', 'fixture', 'database')],
+                         [3, 1.5, 0.75])
+        self.assertEqual(first.contexts['Thing'], [3, 6.0, 3.0])
+
+    def test_report(self):
+        profile = Profile(1)
+        self.add(profile, self.thing, 'test one', 1.0)
+        self.add(profile, self.child, 'test two', 2.0)
+        printer = Printer(colour=False)
+        printer.output = io.StringIO()
+        profile.report(printer)
+        lines = printer.output.getvalue().splitlines()
+        self.assertEqual(lines[0], 'Slowest 1 tests:')
+        self.assertEqual(lines[1].split(), ['2.0000s', '1.0000s', 'cpu',
+                                            'Child', 'test', 'two'])
+        self.assertEqual(lines[2].strip(), '# spec.py:1')
+        self.assertIn('1.0000s   0.5000s cpu      2x  Thing fixture '
+                      '`database`', printer.output.getvalue())
+        # Only the slowest context
+        self.assertEqual(lines[-2].split()[-2:], ['Thing', 'Child'])
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_spec(self, source, count=5):
+        filepath = os.path.join(self.directory, 'spec.py')
+        with open(filepath, 'wb') as fh:
+            fh.write(source)
+        collector = WithSpecCollector()
+        collector.collect_from_file(filepath)
+        printer = Printer(colour=False)
+        printer.output = io.StringIO()
+        runner = WithSpecRunner(hooks=[], profile=count)
+        runner.run(collector.tests, printer)
+        return runner.profile
+
+    def test_examples_are_not_elements(self):
+        profile = self.run_spec(b'from withspec import describe, examples\n'
+                                b'with describe("Sums"):\n'
+                                b'    def offset():\n'
+                                b'        return 10\n'
+                                b'    @examples([{"a": 1}, {"a": 2}])\n'
+                                b'    def test_sum(a, offset):\n'
+                                b'        pass\n')
+        self.assertEqual(list(profile.elements),
+                         [('Sums', 'fixture', 'offset')])
+        self.assertEqual(profile.elements['Sums', 'fixture', 'offset'][0], 2)
+        self.assertEqual(profile.contexts['Sums'][0], 2)
+
+    def test_scoped_fixtures_timed_once(self):
+        profile = self.run_spec(b'from withspec import describe, fixture\n'
+                                b'with describe("Outer"):\n'
+                                b'    @fixture(scope="context")\n'
+                                b'    def db():\n'
+                                b'        return "db"\n'
+                                b'    def test_one(db):\n'
+                                b'        pass\n'
+                                b'    def test_two(db):\n'
+                                b'        pass\n'
+                                b'    def test_three(db):\n'
+                                b'        pass\n')
+        self.assertEqual(profile.elements['Outer', 'fixture', 'db'][0], 1)
+        self.assertEqual(profile.contexts['Outer'][0], 3)
+
+    def test_scoped_async_fixtures_timed_once(self):
+        profile = self.run_spec(b'from withspec import describe, fixture\n'
+                                b'with describe("Outer"):\n'
+                                b'    @fixture(scope="session")\n'
+                                b'    async def db():\n'
+                                b'        return "db"\n'
+                                b'    async def test_one(db):\n'
+                                b'        pass\n'
+                                b'    async def test_two(db):\n'
+                                b'        pass\n')
+        self.assertEqual(profile.elements['Outer', 'fixture', 'db'][0], 1)
+
+    def test_profile_option(self):
+        filepath = os.path.join(self.directory, 'spec.py')
+        with open(filepath, 'wb') as fh:
+            fh.write(b'import time\n'
+                     b'from withspec import describe\n'
+                     b'with describe("Thing"):\n'
+                     b'    def test_slow(test):\n'
+                     b'        time.sleep(0.05)\n'
+                     b'    def test_quick(test):\n'
+                     b'        pass\n')
+        config = process_argv(['--profile', '1', '--no-cache',
+                               self.directory], {})
+        printer = Printer(colour=False)
+        printer.output = io.StringIO()
+        run_specs(config, printer)
+        output = printer.output.getvalue()
+        self.assertIn('Slowest 1 tests:', output)
+        slowest = output.splitlines()[
+            output.splitlines().index('Slowest 1 tests:') + 1]
+        self.assertTrue(slowest.endswith('Thing test slow'))
@@ -0,0 +1,94 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ElementTree
+from unittest import mock
+from withspec.reporters import Reporter, JSONLinesReporter, JUnitReporter
+
+
+class FakeContext(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeTest(object):
+    name = 'does <things>'
+
+    def parents(self):
+        return [FakeContext('Thing'), FakeContext('when "quoted"')]
+
+    def fullname(self):
+        return 'Thing when "quoted" does <things>'
+
+    def definition(self):
+        return 'spec/thing.py:12'
+
+
+class FakeRunner(object):
+    total = 2
+    failed = [None]
+    skipped = []
+    pending = []
+
+
+class TestReporters(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_json_lines(self):
+        reporter = JSONLinesReporter(self.path)
+        reporter.result(FakeTest(), 'passed', 0.5)
+        reporter.result(FakeTest(), 'failed', 0.25, 'AssertionError',
+                        [['Failure/Error: 1 != 2']])
+        reporter.close(FakeRunner())
+        with open(self.path) as fh:
+            records = [json.loads(line) for line in fh]
+        self.assertEqual([record['status'] for record in records],
+                         ['passed', 'failed'])
+        self.assertEqual(records[1]['definition'], 'spec/thing.py:12')
+        self.assertEqual(records[1]['output'], [['Failure/Error: 1 != 2']])
+
+    def test_junit_xml(self):
+        reporter = JUnitReporter(self.path)
+        reporter.result(FakeTest(), 'passed', 0.5, output=[['>> stdout <<']])
+        reporter.result(FakeTest(), 'failed', 0.25, 'AssertionError',
+                        [['Failure/Error: 1 != 2']])
+        reporter.close(FakeRunner())
+        suite = ElementTree.parse(self.path).getroot()
+        self.assertEqual(suite.get('tests'), '2')
+        self.assertEqual(suite.get('failures'), '1')
+        cases = suite.findall('testcase')
+        self.assertEqual(cases[0].get('classname'), 'Thing when "quoted"')
+        self.assertEqual(cases[0].find('system-out').text, '>> stdout <<')
+        self.assertEqual(cases[1].find('failure').get('type'),
+                         'AssertionError')
+
+    def test_junit_xml_never_seeks_stdout(self):
+        # Seekable, as stdout is when redirected to a file
+        stdout = io.StringIO()
+        stdout.write('before\n')
+        with mock.patch('sys.stdout', stdout):
+            reporter = JUnitReporter('-')
+            reporter.result(FakeTest(), 'passed', 0.5)
+            stdout.write('between\n')
+            reporter.close(FakeRunner())
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], 'before')
+        self.assertEqual(lines[2], '<testsuite name="withspec">')
+        self.assertIn('between', lines)
+        self.assertEqual(lines[-1], '</testsuite>')
+
+    def test_base_reporter_ignores_results(self):
+        reporter = Reporter(self.path)
+        reporter.result(FakeTest(), 'passed', 0.5)
+        reporter.close(FakeRunner())
+        with open(self.path) as fh:
+            self.assertEqual(fh.read(), '')
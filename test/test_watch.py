@@ -0,0 +1,178 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from withspec.collector import WithSpecCollector
+from withspec import command
+from withspec.command import process_argv, recollect, watch
+from withspec.printer import Printer
+from withspec.watch import Watcher
+
+SPEC = b'''from withspec import describe
+import helper
+with describe("Thing"):
+    def test_thing(test):
+        test(helper.VALUE).equal(1)
+'''
+
+SHARED = b'''from withspec import shared
+with shared("a widget"):
+    def test_widget(test):
+        pass
+'''
+
+USES = b'''from withspec import describe, it_behaves_like
+with describe("Gadget"):
+    it_behaves_like("a widget")
+'''
+
+
+class WatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # The project, with its spec files in spec/
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.directory = os.path.join(self.root, 'spec')
+        os.mkdir(self.directory)
+        sys.path.insert(0, self.root)
+        self.addCleanup(sys.path.remove, self.root)
+        self.addCleanup(sys.modules.pop, 'helper', None)
+        with open(os.path.join(self.root, 'helper.py'), 'wb') as fh:
+            fh.write(b'VALUE = 1\n')
+        self.write('thing_spec.py', SPEC)
+        self.collector = WithSpecCollector()
+        self.collector.tracker.root = self.root
+        for filepath, line in self.collector.locate(self.directory):
+            self.collector.collect_from_file(filepath)
+        self.mtime = 10 ** 9
+
+    def path(self, name):
+        if name == 'helper.py':
+            return os.path.join(self.root, name)
+        return os.path.join(self.directory, name)
+
+    def write(self, name, source):
+        with open(self.path(name), 'wb') as fh:
+            fh.write(source)
+
+    def touch(self, name):
+        # Modification times can be coarse, so move them on by hand
+        self.mtime += 10 ** 9
+        os.utime(self.path(name), ns=(self.mtime, self.mtime))
+
+
+class TestWatcher(WatchTestCase):
+
+    def setUp(self):
+        WatchTestCase.setUp(self)
+        self.watcher = Watcher(self.collector, [self.directory])
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.watcher.changes(), ([], []))
+
+    def test_spec_changed(self):
+        self.touch('thing_spec.py')
+        self.assertEqual(self.watcher.changes(),
+                         ([self.path('thing_spec.py')], []))
+        self.assertEqual(self.watcher.changes(), ([], []))
+
+    def test_spec_added_and_removed(self):
+        self.write('new_spec.py', SPEC)
+        self.assertEqual(self.watcher.changes(),
+                         ([self.path('new_spec.py')], []))
+        os.remove(self.path('new_spec.py'))
+        self.assertEqual(self.watcher.changes(),
+                         ([], [self.path('new_spec.py')]))
+
+    def test_imported_file_changed(self):
+        # Found through what the spec imported, even outside the locations
+        watcher = Watcher(self.collector, [self.path('thing_spec.py')])
+        self.touch('helper.py')
+        self.assertEqual(watcher.changes(), ([self.path('helper.py')], []))
+
+    def test_location_removed(self):
+        watcher = Watcher(self.collector, [self.path('thing_spec.py')])
+        os.remove(self.path('thing_spec.py'))
+        self.assertEqual(watcher.changes(),
+                         ([], [self.path('thing_spec.py')]))
+
+
+class TestWatch(WatchTestCase):
+
+    def watch(self, *changes):
+        '''Run watch as if Watcher.wait saw each of changes in turn'''
+        config = process_argv(['--no-cache', '--order', 'defined',
+                               self.directory], {})
+        printer = Printer(colour=False)
+        printer.output = io.StringIO()
+        runs = []
+        self.runners = []
+        run_tests = command.run_tests
+        def run(config, tests, printer):
+            runs.append(sorted(test.fullname() for test in tests))
+            runner, time_testing = run_tests(config, tests, printer)
+            self.runners.append(runner)
+            return runner, time_testing
+        with mock.patch.object(Watcher, 'wait',
+                               side_effect=list(changes) +
+                               [KeyboardInterrupt]), \
+             mock.patch.object(command, 'run_tests', run):
+            watch(config, self.collector, printer)
+        return runs
+
+    def test_changed_spec_run_again(self):
+        self.assertEqual(self.watch(([self.path('thing_spec.py')], [])),
+                         [['Thing test thing']])
+
+    def test_imported_file_changed(self):
+        with open(self.path('helper.py'), 'wb') as fh:
+            fh.write(b'VALUE = 2\n')
+        runs = self.watch(([self.path('helper.py')], []))
+        self.assertEqual(runs, [['Thing test thing']])
+        # Run against the reloaded helper
+        self.assertEqual(len(self.runners[0].failed), 1)
+
+    def test_removed_spec_forgotten(self):
+        os.remove(self.path('thing_spec.py'))
+        runs = self.watch(([], [self.path('thing_spec.py')]))
+        self.assertEqual(runs, [[]])
+        self.assertEqual(self.collector.files, {})
+        self.assertEqual(self.collector.tests, [])
+
+    def test_renamed_spec(self):
+        os.rename(self.path('thing_spec.py'), self.path('other_spec.py'))
+        runs = self.watch(([self.path('other_spec.py')],
+                           [self.path('thing_spec.py')]))
+        self.assertEqual(runs, [['Thing test thing']])
+        self.assertEqual(list(self.collector.files),
+                         [self.path('other_spec.py')])
+        self.assertEqual(len(self.collector.tests), 1)
+
+
+class TestRecollect(WatchTestCase):
+
+    def test_users_of_shared_groups_recollected(self):
+        self.write('shared_spec.py', SHARED)
+        self.write('uses_spec.py', USES)
+        for name in ('shared_spec.py', 'uses_spec.py'):
+            self.collector.collect_from_file(self.path(name))
+        printer = Printer(colour=False)
+        printer.output = io.StringIO()
+        tests = recollect(self.collector, [self.path('shared_spec.py')],
+                          printer)
+        self.assertEqual([test.fullname() for test in tests],
+                         ['Gadget [a widget] test widget'])
+
+    def test_broken_spec(self):
+        self.write('thing_spec.py', b'raise ValueError("broken")\n')
+        printer = Printer(colour=False)
+        printer.output = io.StringIO()
+        tests = recollect(self.collector, [self.path('thing_spec.py')],
+                          printer)
+        self.assertEqual(tests, [])
+        self.assertIn('ValueError: broken', printer.output.getvalue())
+        self.assertNotIn(self.path('thing_spec.py'), self.collector.files)
@@ -1 +1,9 @@
-from .decorators import describe, context, shared, it_behaves_like
+from .decorators import (
+    describe,
+    context,
+    shared,
+    it_behaves_like,
+    fixture,
+    tag,
+    examples,
+)
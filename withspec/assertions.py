@@ -1,9 +1,15 @@
 import unittest
 import logging
+from functools import partial
 from .registry import get_registry
 
 log = logging.getLogger(__name__)
 
+# (assertor class, name) -> the assertion function the name resolved to,
+# or None if it didn't. Misses are kept too, as a test expecting a name to
+# be missing (say with hasattr) would otherwise search for it every time.
+_resolved = {}
+
 
 class Assertions(unittest.TestCase):
     '''A Wrapper to make all of the standard assertions available to 
@@ -68,10 +74,15 @@ class Assertions(unittest.TestCase):
 
 
 class AssertionSubject(object):
+    __slots__ = ('wrapped', 'subject')
+
     def __init__(self, wrapped, subject):
         self.wrapped = wrapped
         self.subject = subject
-        self.to = ExpectationSyntaxWrapper(wrapped, subject)
+
+    @property
+    def to(self):
+        return ExpectationSyntaxWrapper(self.wrapped, self.subject)
 
     def __getattr__(self, name):
         # Attempt ao locate the assertion name
@@ -101,18 +112,30 @@ class AssertionSubject(object):
         #
         #   equal -> assert_equal
         #   equal -> assertEqual
-
-        for name in self.assert_names(name):
-            log.debug("Trying assertion method '%s'" % name)
+        #
+        # The same few names are used over and over, so each is only
+        # resolved once for each class of assertor.
+        key = (self.wrapped.__class__, name)
+        try:
+            assert_func = _resolved[key]
+        except KeyError:
+            assert_func = _resolved[key] = self.resolve(*key)
+        if assert_func is None:
+            raise AttributeError("'%s' has no assertion '%s'" %
+                                 (key[0].__name__, name))
+        return partial(assert_func, self.wrapped, self.subject)
+
+    def resolve(self, assertor, name):
+        '''Return the function on the assertor class that name refers to,
+        or None'''
+        for candidate in self.assert_names(name):
+            log.debug("Trying assertion method '%s'" % candidate)
             # Reference: https://hynek.me/articles/hasattr/
             # 'hasattr' executes anyway and is no quicker than getattr
-            assert_func = getattr(self.wrapped, name, None)
+            assert_func = getattr(assertor, candidate, None)
             if assert_func is not None:
-                break
-
-        def wrap_assertion(*args, **kwargs):
-            return assert_func(self.subject, *args, **kwargs)
-        return wrap_assertion
+                return assert_func
+        return None
 
     def assert_names(self, name, prefix='assert'):
         yield name
@@ -153,9 +176,25 @@ class AssertionSubject(object):
 
 
 class ExpectationSyntaxWrapper():
+    __slots__ = ('wrapped', 'subject')
+
     def __init__(self, wrapped, subject):
         self.wrapped = wrapped
         self.subject = subject
 
     def be_true(self):
         return self.wrapped.assertTrue(self.subject)
+
+
+# Copied for each test, rather than building a TestCase each time
+_prototype = Assertions()
+
+
+def get_assertor():
+    '''Return a new assertor. A test can change one, say its maxDiff or
+    with addTypeEqualityFunc, so each gets its own.'''
+    assertor = Assertions.__new__(Assertions)
+    assertor.__dict__.update(_prototype.__dict__)
+    assertor._type_equality_funcs = dict(_prototype._type_equality_funcs)
+    assertor._cleanups = []
+    return assertor
@@ -0,0 +1,146 @@
+import os
+import json
+import marshal
+import hashlib
+import logging
+from importlib.util import MAGIC_NUMBER
+
+log = logging.getLogger(__name__)
+
+VERSION = 3
+
+
+class CacheEntry(object):
+    '''What we remember about a single spec file.
+
+    code is the compiled module, kinds maps the key of each context the
+    file defines, from `collector.context_keys`, to its
+    `Context.element_kinds`, and resolved says whether those kinds
+    already account for fixtures referenced from child contexts. Files
+    using shared groups are never resolved, their kinds are only what the
+    file decides alone.
+    '''
+    def __init__(self, code, kinds=None, resolved=False,
+                 mtime=None, size=None, digest=None):
+        self.code = code
+        self.kinds = kinds
+        self.resolved = resolved
+        self.mtime = mtime
+        self.size = size
+        self.digest = digest
+        self.fresh = True  # Whether the file's stat matched when loaded
+
+
+class CollectionCache(object):
+    '''An on-disk cache of compiled spec files.
+
+    Entries are keyed by the file's path, and are valid while its mtime
+    and size are unchanged, or failing that while its contents hash the
+    same. Only the kinds are kept in that case, the code is compiled
+    again from the file.
+
+    Each is a line of JSON followed by the marshalled code, so nothing is
+    unpickled. The code is still run as it was stored, so like any
+    bytecode cache, the directory must be trusted as much as the specs.
+    '''
+    def __init__(self, directory='.withspec_cache'):
+        # Collection changes directory, so hold on to where we started
+        self.directory = os.path.abspath(directory)
+
+    def path(self, abspath, filepath):
+        # The filepath is compiled into the code objects, so is part
+        # of the key as much as where the file lives
+        key = '%s\0%s' % (abspath, filepath)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'files', name + '.cache')
+
+    def load(self, abspath, filepath):
+        try:
+            with open(self.path(abspath, filepath), 'rb') as fh:
+                header, code = fh.read().split(b'\n', 1)
+            data = json.loads(header.decode('utf-8'))
+            if data['version'] != VERSION or \
+               data['magic'] != MAGIC_NUMBER.hex():
+                return None
+            stat = os.stat(abspath)
+            kinds = data['kinds']
+            if kinds is not None:
+                kinds = dict(((tuple(names), count), context_kinds)
+                             for names, count, context_kinds in kinds)
+            entry = CacheEntry(code=None,
+                               kinds=kinds,
+                               resolved=data['resolved'],
+                               mtime=data['mtime'],
+                               size=data['size'],
+                               digest=data['digest'])
+            if (stat.st_mtime_ns, stat.st_size) != (entry.mtime, entry.size):
+                # Touched, but may not have changed
+                with open(abspath, 'rb') as fh:
+                    source = fh.read()
+                if self.digest(source) != entry.digest:
+                    log.debug('Cache is out of date for %s', filepath)
+                    return None
+                # Nothing ties the stored code to the source, only the
+                # stat, so don't trust it once that has changed
+                entry.code = compile(source, filepath, 'exec')
+                entry.fresh = False
+            else:
+                entry.code = marshal.loads(code)
+        except Exception as ex:
+            log.debug('No usable cache for %s (%s)', filepath, ex)
+            return None
+        log.debug('Loaded %s from the cache', filepath)
+        return entry
+
+    def store(self, abspath, filepath, source, code,
+              kinds=None, resolved=False):
+        stat = os.stat(abspath)
+        if kinds is not None:
+            kinds = [[names, count, context_kinds] for (names, count),
+                     context_kinds in sorted(kinds.items())]
+        data = {
+            'version': VERSION,
+            'magic': MAGIC_NUMBER.hex(),
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'digest': self.digest(source),
+            'kinds': kinds,
+            'resolved': resolved,
+        }
+        try:
+            write_atomic(self.path(abspath, filepath),
+                         json.dumps(data, sort_keys=True).encode('utf-8') +
+                         b'\n' + marshal.dumps(code))
+        except OSError as ex:
+            log.warning('Unable to cache %s: %s', filepath, ex)
+
+    def digest(self, source):
+        return hashlib.sha1(source).hexdigest()
+
+
+def write_atomic(path, data):
+    '''Write data (bytes) to path, creating its directory if need be.
+
+    It is written beside path then moved over it, so a concurrent reader
+    never sees half of it. Raises OSError if it can't be, having removed
+    anything half written.
+    '''
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def get_cache(config):
+    '''Return the collection cache configured, if any'''
+    if config.get('no_cache', False):
+        return None
+    return CollectionCache(config.get('cache_dir', '.withspec_cache'))
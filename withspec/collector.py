@@ -1,10 +1,12 @@
 import os
 import sys
+import time
 import logging
-import inspect
 from collections import deque
-from .registry import get_registry
-from .elements import TestElement, UnknownElement
+from .deps import ImportTracker
+from .lines import LineIndex
+from .registry import SharedIndex, get_registry, scoped_registry
+from .elements import TestElement, ExamplesElement, UnknownElement
 
 log = logging.getLogger(__name__)
 
@@ -20,44 +22,122 @@ class WithSpecCatcher(dict):
 
     def __setitem__(self, name, value):
         dict.__setitem__(self, name, value)
+        if self.registry is None:
+            return
         if not name.startswith('__'):
             context = self.registry.current_context()
-            if value.__module__ != self.module:
+            if getattr(value, '__module__', None) != self.module:
                 return
             if context is None:
                 return
             log.debug('Caught `%s`', name)
             self.elements.append(context.add_element(name, value))
 
+    def release(self):
+        '''Stop catching, once the file has run. Its functions keep us as
+        their globals, and those of a shared group outlive the file, so
+        we mustn't keep every context and element of the file alive.'''
+        self.registry = None
+        self.elements = []
+
+
+class CollectedFile(object):
+    '''What a single spec file contributed to a collection'''
+    def __init__(self, filepath, tests, shared, uses, imports):
+        self.filepath = filepath
+        self.tests = tests        # The tests built from this file
+        self.shared = shared      # Names of the shared groups it defines
+        self.uses = uses          # Names of the shared groups it behaves like
+        self.imports = imports    # Project files it (indirectly) imports
+
+
+def context_keys(contexts):
+    '''Key each of contexts, in the order they were entered, by its name
+    and those of its parents, along with how many before it had the same.
+    A file's contexts can depend on more than its source, so a context
+    that comes or goes mustn't shift the others.'''
+    seen = {}
+    keys = []
+    for context in contexts:
+        names = []
+        parent = context
+        while parent is not None:
+            names.append(parent.name)
+            parent = parent.parent
+        names = tuple(reversed(names))
+        count = seen.get(names, 0)
+        seen[names] = count + 1
+        keys.append((names, count))
+    return keys
+
 
 class WithSpecCollector(object):
-    def __init__(self, random=False, seed=None):
+    def __init__(self, random=False, seed=None, cache=None):
         self.random = random
         self.seed = seed
+        self.cache = cache
         self.module = '__spec__'
         self.tests = []
+        self.shared = SharedIndex()
+        self.files = {}
+        self.tracker = ImportTracker()
+        self.time_loading = 0.0  # Spent collecting by `stream`
 
     def collect(self, location):
         log.info('Browsing for tests in {}'.format(location))
+        for filepath, line in self.locate(location):
+            self.collect_from_file(filepath, line)
+
+    def stream(self, files):
+        '''Collect files, (filepath, line) tuples, one at a time, yielding
+        the tests built from each. They aren't kept by the collector, so
+        once the caller is done with them they can be freed, along with
+        the contexts of their file. Only what `file_imports` and shared
+        groups need is remembered.'''
+        for filepath, line in files:
+            # Not held in a local, which would outlive the batch
+            yield self.collect_alone(filepath, line)
+
+    def collect_alone(self, filepath, line=None):
+        time_start = time.time()
+        first_test = len(self.tests)
+        self.collect_from_file(filepath, line)
+        tests = self.tests[first_test:]
+        del self.tests[first_test:]
+        collected = self.files[filepath]
+        self.files[filepath] = CollectedFile(filepath, [], collected.shared,
+                                             collected.uses,
+                                             collected.imports)
+        self.time_loading += time.time() - time_start
+        return tests
+
+    def locate(self, location):
+        '''Return a list of (filepath, line) tuples for the spec files
+        found at location. line is None unless location referenced one.
+        '''
         if os.path.isdir(location):
-            return self.collect_from_dir(location)
+            return [(filename, None)
+                    for filename in self.find_files(location)]
         if os.path.isfile(location):
-            return self.collect_from_file(location)
+            return [(location, None)]
         if ':' in location:
             # Try to see if there is a line number reference
             filename, line_no = location.rsplit(':', 1)
             if os.path.isfile(filename):
-                return self.collect_from_file(filename, int(line_no))
+                return [(filename, int(line_no))]
         raise ValueError('No such file or directory: {}'.format(location))
 
-    def collect_from_dir(self, dirname):
+    def find_files(self, dirname):
         log.debug('Walking over {}'.format(dirname))
         valid_files = []
         for root, dirs, files in os.walk(dirname, followlinks=True):
             for filename in files:
                 if filename.endswith('.py'):
                     valid_files.append(os.path.join(root, filename))
-        for filename in valid_files:
+        return valid_files
+
+    def collect_from_dir(self, dirname):
+        for filename in self.find_files(dirname):
             self.collect_from_file(filename)
 
     def collect_from_file(self, filepath, line=None):
@@ -65,63 +145,150 @@ class WithSpecCollector(object):
         cwd = os.getcwd()
         log.debug('Collecting from file {}'.format(filepath))
         dirname, filename = os.path.split(abspath)
+
+        caching = self.cache is not None
+        entry = None
+        source = None
+        if caching:
+            entry = self.cache.load(abspath, filepath)
+        if entry is None:
+            with open(abspath, 'rb') as fh:
+                source = fh.read()
+            code = compile(source, filepath, 'exec')
+        else:
+            code = entry.code
+
         os.chdir(dirname)
         sys.path.insert(0, dirname)
-
         try:
-            with open(filename, 'r') as fh:
-                 file_globals = WithSpecCatcher(
-                     collector=self,
-                     __name__=self.module,
-                     __file__=filepath,
-                     __package__=None,
-                 )
-                 code = compile(fh.read(), filepath, 'exec')
-                 exec(code, file_globals)
+            with scoped_registry() as registry:
+                file_globals = WithSpecCatcher(
+                    collector=self,
+                    __name__=self.module,
+                    __file__=filepath,
+                    __package__=None,
+                )
+                with self.tracker(file_globals) as imported:
+                    exec(code, file_globals)
+                file_globals.release()
         finally:
             os.chdir(cwd)
             try:
                 sys.path.remove(dirname)
             except ValueError:
                 pass
+        # Every context this file defined, in the order they were entered
+        file_contexts = registry.all_contexts()
+        if entry is not None and entry.kinds is not None:
+            for key, context in zip(context_keys(file_contexts),
+                                    file_contexts):
+                context.kinds = entry.kinds.get(key, None)
+        uses = set()
+        for context in file_contexts:
+            uses.update(context.behaviour_names)
+
         # Separate Contexts from behaviours
-        behaviours, contexts = self.resolve_contexts(get_registry().contexts)
+        behaviours, contexts = self.resolve_contexts(registry.contexts)
+        for behaviour in behaviours.values():
+            self.shared.add(filepath, behaviour)
 
         # Iterate the contexts and build a list of 'elements'/'potential tests'
-        elements = self.extract_elements(behaviours, contexts)
+        elements = self.extract_elements(contexts)
 
         # Allow each Captured Element a chance to Resolve its args.
         # This allows the Contexts to determine what args have been
         # called, which lets them decide if a function is a fixture 
         # or a test (if not labeled as such).
+        first_test = len(self.tests)
+        kinds = None
         if line is None:
-            self.resolve_and_build(elements)
-            return
+            if len(uses) > 0:
+                # Shared groups can be defined in other files, and can turn
+                # our tests in to fixtures, so only remember what this
+                # file decides alone
+                kinds = self.file_kinds(file_contexts)
+            resolved = entry is not None and entry.resolved
+            self.resolve_and_build(elements, resolve=not resolved)
+            if len(uses) == 0:
+                kinds = self.file_kinds(file_contexts)
+            if caching and \
+               (entry is None or not entry.fresh or entry.kinds is None):
+                if source is None:
+                    with open(abspath, 'rb') as fh:
+                        source = fh.read()
+                self.cache.store(abspath, filepath, source, code, kinds,
+                                 len(uses) == 0)
+        else:
+            if source is None:
+                with open(abspath, 'rb') as fh:
+                    source = fh.read()
+            if caching and entry is None:
+                # Only some of the file is resolved, so just keep the code
+                self.cache.store(abspath, filepath, source, code)
+            self.resolve_and_build(
+                self.select_line(elements, file_contexts, line,
+                                 LineIndex(source, filepath)))
 
-        # Locate a test on that line number
-        for element in file_globals.elements:
-            lines, lineno = inspect.getsourcelines(element.actual)
-            if lineno <= line <= (lineno + len(lines) - 1):
-                self.resolve_and_build([element])
-                return
+        self.files[filepath] = CollectedFile(
+            filepath,
+            tests=self.tests[first_test:],
+            shared=set(behaviours),
+            uses=uses,
+            imports=self.tracker.files(imported),
+        )
 
-        # Locate a the first test after the given line and then catch
-        # all the tests in that context
-        # TODO: Re-jig this to use the context stack instead
-        raise Exception('Not yet implemented')
-        context = None
-        for element in file_globals.elements:
-            lines, lineno = inspect.getsourcelines(element.actual)
-            if lineno > line:
-                context = element.context
-                break
-        if context is None:
-            return
-        elements = []
-        for element in file_globals.elements:
-            if element.context == context:
-                elements.append(element)
-        self.resolve_and_build(elements)
+    def select_line(self, elements, contexts, line, index):
+        '''Return the elements to build for a test on the given line.
+
+        A line within a context, but not a test, selects every test in the
+        context. A line outside of any selects the next context.
+        '''
+        tests = {}  # First line -> the tests defined there
+        for element in elements:
+            code = getattr(element.actual, '__code__', None)
+            if code is not None:
+                tests.setdefault(code.co_firstlineno, []).append(element)
+        starts = dict((context.line, context) for context in contexts
+                      if context.line is not None)
+
+        spans = index.enclosing(line)
+        if len(spans) == 0:
+            spans = [span for span in index.following(line)
+                     if span[2] == 'with'][:1]
+        for start, end, kind in spans:
+            if kind == 'def':
+                if start in tests:
+                    return tests[start]
+                continue  # Perhaps a fixture, or a function in a test
+            context = starts.get(start, None)
+            selected = []
+            for element in elements:
+                code = getattr(element.actual, '__code__', None)
+                if code is not None and start <= code.co_firstlineno <= end:
+                    selected.append(element)
+                elif context is not None and context in element.parents():
+                    # Such as the tests of a shared group it behaves like
+                    selected.append(element)
+            if len(selected) > 0:
+                return selected
+        return []
+
+    def forget(self, filepath):
+        '''Drop the tests collected from filepath, so it can be collected
+        again. Returns the `CollectedFile` forgotten, if any.'''
+        collected = self.files.pop(filepath, None)
+        if collected is not None:
+            dropped = set(id(test) for test in collected.tests)
+            self.tests = [test for test in self.tests
+                          if id(test) not in dropped]
+            self.shared.forget(filepath)
+        return collected
+
+    def file_kinds(self, file_contexts):
+        return dict((key, context.element_kinds())
+                    for key, context in zip(context_keys(file_contexts),
+                                            file_contexts)
+                    if not context.shared())
 
     def resolve_contexts(self, all_contexts):
         behaviours = {}
@@ -133,15 +300,16 @@ class WithSpecCollector(object):
                 contexts.append(context)
         return behaviours, contexts
 
-    def extract_elements(self, behaviours, contexts):
+    def extract_elements(self, contexts):
         elements = []
         for context in contexts:
-            context.finalise()
+            context.finalise(context.kinds)
             for element in context.elements['tests']:
                 elements.append(element)
             # Add any behaviours
             for behaviour_name in context.behaviour_names:
-                if behaviour_name not in behaviours:
+                behaviour = self.shared.get(behaviour_name)
+                if behaviour is None:
                     log.debug('Requested unknown shared group `%s` for'
                               ' context `%s`', 
                               behaviour_name, context.name)
@@ -153,20 +321,22 @@ class WithSpecCollector(object):
                 else:
                     log.debug('Adding behaviour `%s` to context `%s`', 
                               behaviour_name, context.name)
-                    new_context = behaviours[behaviour_name].\
-                                    create_context(parent=context)
+                    new_context = behaviour.create_context(parent=context)
 
             # Iterate child contexts
-            elements.extend(self.extract_elements(behaviours, context.children))
+            elements.extend(self.extract_elements(context.children))
         return elements
 
-    def resolve_and_build(self, elements):
-        for element in elements:
-            element.resolve_fixtures()
+    def resolve_and_build(self, elements, resolve=True):
+        if resolve:
+            for element in elements:
+                element.resolve_fixtures()
 
         for element in elements:
             test = element.build()
-            if test is not None:
+            if isinstance(test, ExamplesElement):
+                self.tests.extend(test.expand())
+            elif test is not None:
                 self.tests.append(test)
 
 
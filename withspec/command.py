@@ -1,21 +1,40 @@
+import os
 import sys
 import time
 import logging
 import textwrap
 import configparser
 import random
+import importlib
+import traceback
 from io import StringIO
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+from .cache import get_cache
 from .collector import WithSpecCollector
-from .hooks import StdOutHook, LogHook, TraceBackHook
+from .deps import DependencyMap
+from .history import History, order_tests, shard_files
+from .hooks import default_hooks
 from .runner import WithSpecRunner
-from .printer import Printer
+from .printer import Printer, BufferedPrinter
+from .reporters import configured_reporters, open_reporters
 
 log = logging.getLogger(__name__)
 
 truthy = ('1', 'true', 't', 'y', 'yes', 'on')
 
 LOG_FORMAT = '[1;31m%(levelname)-5.6s [0m%(message)s'
+ORDERS = {'d': 'defined', 'r': 'random', 'f': 'failed'}
+
+
+def shard(value):
+    '''Parse i/N in to a (index, count) tuple, where index is from 0'''
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ArgumentTypeError('expected i/N, eg. 1/4')
+    if not 1 <= index <= count:
+        raise ArgumentTypeError('i must be from 1 to N')
+    return index - 1, count
 
 
 def asbool(value):
@@ -62,19 +81,37 @@ def process_argv(argv, config):
         '--order',
         dest='order',
         action='store',
-        choices=['defined', 'random'],
+        choices=['defined', 'random', 'failed'],
         default=config.pop('order', 'random'),
-        help='Run the tests in random order, or the order in which they ' \
-             'were defined.',
+        help='Run the tests in random order, the order in which they ' \
+             'were defined, or those which failed last time first and ' \
+             'then the quickest.',
     )
     order.add_argument(
         '-o',
         dest='order',
         action='store',
-        choices={'d': 'defined', 'r': 'random'},
+        choices=ORDERS,
         default='r',
         help='Synonym for --order',
     )
+    parser.add_argument(
+        '--shard',
+        action='store',
+        type=shard,
+        default=config.pop('shard', None),
+        metavar='i/N',
+        help='Only collect and run shard i of N, splitting the spec files ' \
+             'so each shard takes about as long, going by the durations ' \
+             'of the last run',
+    )
+    parser.add_argument(
+        '--last-failed', '--lf',
+        action='store_true',
+        default=config.pop('last_failed', False),
+        help='Only run the tests which failed last time, or all of them ' \
+             'if none did',
+    )
     parser.add_argument(
         '--seed',
         action='store',
@@ -90,6 +127,15 @@ def process_argv(argv, config):
         default=config.pop('fail_fast', False),
         help='Exit the run as soon as a test has failed',
     )
+    parser.add_argument(
+        '--buffer',
+        action='store',
+        choices=['off', 'batch', 'thread'],
+        default=config.pop('buffer', 'off'),
+        help='Collect the output and write it in batches, from the main ' \
+             'thread or a separate writer thread. Speeds up runs writing ' \
+             'to a slow pipe, such as a CI log',
+    )
     colour = parser.add_mutually_exclusive_group()
     colour.add_argument(
         '-c', '--colour', '--color',
@@ -115,6 +161,92 @@ def process_argv(argv, config):
         default=config.pop('no_logs', False),
         help="Don't capture logs",
     )
+    parser.add_argument(
+        '--json',
+        action='store',
+        default=config.pop('json', None),
+        metavar='PATH',
+        help='Also write each result to PATH as a line of JSON, ' \
+             'as it finishes. Use - for stdout',
+    )
+    parser.add_argument(
+        '--junit-xml',
+        action='store',
+        default=config.pop('junit_xml', None),
+        metavar='PATH',
+        help='Also write the results to PATH as JUnit XML, ' \
+             'as each finishes. Use - for stdout',
+    )
+    parser.add_argument(
+        '-p', '--profile',
+        action='store',
+        type=int,
+        nargs='?',
+        const=10,
+        default=config.pop('profile', 0),
+        metavar='N',
+        help='Time each test and fixture, and report the slowest N ' \
+             '(10 if not given) tests, fixtures and contexts',
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        action='store',
+        type=int,
+        default=config.pop('jobs', 1),
+        help='Split the spec files across this many worker processes, ' \
+             'which each collect and run their own share',
+    )
+    parser.add_argument(
+        '--concurrency',
+        action='store',
+        type=int,
+        default=config.pop('concurrency', 1),
+        metavar='N',
+        help='Run up to N coroutine tests at once, where they share no ' \
+             'context or session fixtures',
+    )
+    parser.add_argument(
+        '--threads',
+        action='store',
+        type=int,
+        default=config.pop('threads', 1),
+        metavar='N',
+        help='Run tests tagged threadsafe, or in a context described with ' \
+             'thread_safe=True, across N threads',
+    )
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument(
+        '--cache-dir',
+        action='store',
+        default=config.pop('cache_dir', '.withspec_cache'),
+        help='Where to keep compiled spec files between runs',
+    )
+    cache.add_argument(
+        '--no-cache',
+        action='store_true',
+        default=config.pop('no_cache', False),
+        help="Don't read or write the collection cache",
+    )
+    parser.add_argument(
+        '--changed',
+        action='append',
+        metavar='FILE',
+        help='Only run the spec files which are, or import, this file. '
+             'Can be given multiple times',
+    )
+    parser.add_argument(
+        '--diff',
+        action='store',
+        metavar='REVISIONS',
+        help='Only run the spec files affected by the files changed in ' \
+             'this git revision range, eg. "main" or "HEAD~3..HEAD"',
+    )
+    parser.add_argument(
+        '-w', '--watch',
+        action='store_true',
+        default=config.pop('watch', False),
+        help='Keep running, and re-run the specs in any file that changes',
+    )
     parser.add_argument(
         '--dryrun', '--dry-run',
         action='store_true',
@@ -135,7 +267,18 @@ def process_argv(argv, config):
         default=config.pop('locations', ['spec']),
         help='The files or directories to search for tests.',
     )
-    config.update(vars(parser.parse_args(argv)))
+    args = parser.parse_args(argv)
+    if args.watch and args.jobs > 1:
+        parser.error('--watch runs in a single process, and cannot be '
+                     'combined with --jobs')
+    args.order = ORDERS.get(args.order, args.order)
+    if args.no_cache and (args.last_failed or args.order == 'failed'):
+        parser.error('Results of the last run are kept in the cache, '
+                     'which is turned off')
+    if args.json == '-' and args.junit_xml == '-':
+        parser.error('Only one of --json and --junit-xml can write to '
+                     'stdout')
+    config.update(vars(args))
     return config
 
 
@@ -148,12 +291,13 @@ def run(argv=sys.argv[1:]):
         '~/.withspec',
     ]
     bools = ['colour', 'dryrun', 'fail_fast', 
-             'no_logs', 'no_stdout', 'backtrace']
+             'no_logs', 'no_stdout', 'backtrace', 'no_cache', 'watch',
+             'last_failed']
     lists = ['locations']
     aliases = {'color': 'colour'}
     config = {}
 
-    file_parser = configparser.SafeConfigParser()
+    file_parser = configparser.ConfigParser()
     file_parser.read(config_files)
     if file_parser.has_section('withspec'):
         # Tidy up values and keys
@@ -182,48 +326,159 @@ def run(argv=sys.argv[1:]):
     else:
         logger.setLevel((4 - config['debug']) * 10)
 
-    collector = WithSpecCollector()
-    time_start = time.time()
+    printer = make_printer(config)
+    try:
+        run_specs(config, printer)
+    finally:
+        printer.close()
+
+
+def make_printer(config):
+    detailed = config['format'] == 'detailed'
+    if config['buffer'] == 'off':
+        printer = Printer(colour=config['colour'], detailed=detailed)
+    else:
+        printer = BufferedPrinter(colour=config['colour'], detailed=detailed,
+                                  background=config['buffer'] == 'thread')
+    if any(path == '-' for reporter, path in configured_reporters(config)):
+        # A reporter has stdout to itself
+        printer.output = sys.stderr
+    return printer
+
+
+def run_specs(config, printer):
+    collector = WithSpecCollector(cache=get_cache(config))
+    files = []
     for location in config['locations']:
-        collector.collect(location)
-    time_loading = time.time() - time_start
-    log.info('Collected %s tests in %.4f seconds' % (len(collector.tests),
-                                                     time_loading))
-
-    hooks = []
-    # In the future these should be configurable, so you
-    # could write a wrapper/plugin, and add it here
- 
-    # Our Hooks are built in this order deliberately
-    if not config['no_logs']:
-        hooks.append(LogHook(config))
-    if not config['no_stdout']:
-        hooks.append(StdOutHook(config))
-    # TraceBackHook is mandatory, as it formats tracebacks
-    hooks.append(TraceBackHook(config))
-
-    printer = Printer(colour=config['colour'],
-                      detailed=config['format'] == 'detailed')
-
-    runner = WithSpecRunner(dryrun=config['dryrun'], 
-                            fail_fast=config['fail_fast'],
-                            hooks=hooks)
+        files.extend(collector.locate(location))
 
-    if config['order'] == 'random':
-        random.seed(config['seed'])
-        random.shuffle(collector.tests)
+    if config['shard'] is not None:
+        index, count = config['shard']
+        history = load_history(config)
+        durations = None
+        if history is not None:
+            durations = history.file_durations()
+        selected = shard_files(files, index, count, durations)
+        log.info('Shard %d of %d has %d of %d spec files', index + 1, count,
+                 len(selected), len(files))
+        files = selected
+
+    dependencies = None
+    if not config['no_cache']:
+        dependencies = DependencyMap.load(config['cache_dir'])
+    if config['changed'] is not None or config['diff'] is not None:
+        changed = list(config['changed'] or [])
+        if config['diff'] is not None:
+            from .deps import git_changed_files
+            try:
+                changed.extend(git_changed_files(config['diff']))
+            except ValueError as ex:
+                sys.exit('withspec: error: --diff %s: %s' % (config['diff'],
+                                                             ex))
+        if dependencies is None:
+            log.warning('Spec dependencies are kept in the cache, '
+                        'so every spec file will be run')
+        else:
+            selected = dependencies.select(files, changed)
+            log.info('Selected %d of %d spec files', len(selected),
+                     len(files))
+            files = selected
+
+    if config['jobs'] > 1:
+        # Each worker collects its own share of the files
+        from .parallel import ParallelRunner
+        runner = ParallelRunner(dryrun=config['dryrun'],
+                                fail_fast=config['fail_fast'],
+                                profile=config['profile'],
+                                reporters=open_reporters(config),
+                                hooks=[],
+                                history=load_history(config),
+                                jobs=config['jobs'],
+                                config=config)
+        time_start = time.time()
+        try:
+            runner.run(files, printer)
+        finally:
+            runner.close()
+        time_testing = time.time() - time_start
+        time_loading = runner.time_loading
+        imports = runner.imports
+    elif config['order'] == 'defined' and not config['last_failed'] and \
+         not config['watch']:
+        # Nothing needs every test up front, so only hold a file's worth
+        runner = make_runner(config)
+        time_start = time.time()
+        try:
+            runner.stream(collector.stream(files), printer)
+        finally:
+            runner.close()
+        time_loading = collector.time_loading
+        time_testing = time.time() - time_start - time_loading
+        imports = file_imports(collector)
+    else:
+        time_start = time.time()
+        for filepath, line in files:
+            collector.collect_from_file(filepath, line)
+        time_loading = time.time() - time_start
+        log.info('Collected %s tests in %.4f seconds' % (len(collector.tests),
+                                                         time_loading))
+        imports = file_imports(collector)
+        runner, time_testing = run_tests(config, collector.tests, printer)
+
+    if dependencies is not None:
+        dependencies.update(imports)
+        dependencies.save()
+
+    summarise(config, printer, runner, time_testing, time_loading)
+    if config['watch']:
+        watch(config, collector, printer, dependencies)
+
+
+def file_imports(collector):
+    return dict((filepath, collected.imports)
+                for filepath, collected in collector.files.items())
+
+
+def load_history(config):
+    if config['no_cache']:
+        return None
+    return History.load(config['cache_dir'])
+
+
+def make_runner(config, history=None):
+    if history is None:
+        history = load_history(config)
+    return WithSpecRunner(dryrun=config['dryrun'],
+                          fail_fast=config['fail_fast'],
+                          profile=config['profile'],
+                          reporters=open_reporters(config),
+                          concurrency=config['concurrency'],
+                          threads=config['threads'],
+                          history=history,
+                          hooks=default_hooks(config))
+
+
+def run_tests(config, tests, printer):
+    history = load_history(config)
+    runner = make_runner(config, history)
+    order_tests(config, tests, history)
 
     time_start = time.time()
-    runner.run(collector.tests, printer)
-    time_testing = time.time() - time_start
+    try:
+        runner.run(tests, printer)
+    finally:
+        # Even if interrupted, so the reporters' output is complete
+        runner.close()
+    return runner, time.time() - time_start
 
 
+def summarise(config, printer, runner, time_testing, time_loading):
     printer.new_line()
     printer.line('Finished in {:.3f} seconds (tests took {:.3f} seconds to ' \
                   'load)', time_testing, time_loading)
     printer.red('{total:d} tests, {pending:d} pending, ' \
                 '{failed:d} failures, {skipped:d} skipped',
-                total=len(collector.tests),
+                total=runner.total,
                 pending=len(runner.pending),
                 failed=len(runner.failed),
                 skipped=len(runner.skipped),
@@ -233,10 +488,82 @@ def run(argv=sys.argv[1:]):
         printer.line('Failed Tests:')
         printer.new_line()
         for test, output in runner.failed:
-            printer.red('withspec %s' % test.definition(), new_line=False)
-            printer.cyan(' # {}'.format(test.fullname()))
+            printer.red('withspec %s' % test.definition(), new_line=False,
+                        raw=True)
+            printer.cyan(' # %s' % test.fullname(), raw=True)
         printer.new_line()
+    if runner.profile is not None:
+        runner.profile.report(printer)
     if config['order'] == 'random':
         printer.line('Randomized with seed {:d}'.format(config['seed']))
         printer.new_line()
 
+
+def watch(config, collector, printer, dependencies=None):
+    '''Keep re-collecting and re-running the spec files that change,
+    until interrupted'''
+    from .watch import Watcher, loaded_modules
+    watcher = Watcher(collector, config['locations'])
+    while True:
+        printer.line('Watching {} for changes...',
+                     ', '.join(config['locations']), colour='cyan')
+        printer.flush()
+        try:
+            changed, removed = watcher.wait()
+        except KeyboardInterrupt:
+            return
+
+        for filepath in removed:
+            collector.forget(filepath)
+
+        # Spec files import their neighbours, which need to be fresh
+        # before we re-collect anything
+        modules = [module.__name__ for module in loaded_modules(changed)]
+        for name in collector.tracker.reload_order(modules):
+            log.info('Reloading %s', name)
+            try:
+                importlib.reload(sys.modules[name])
+            except Exception:
+                printer.red(traceback.format_exc(), raw=True)
+
+        affected = set(filepath for filepath in changed
+                       if filepath in watcher.specs)
+        changed = set(os.path.abspath(filepath) for filepath in changed)
+        for filepath, collected in collector.files.items():
+            if not changed.isdisjoint(collected.imports):
+                affected.add(filepath)
+
+        time_start = time.time()
+        tests = recollect(collector, sorted(affected), printer)
+        time_loading = time.time() - time_start
+        if dependencies is not None:
+            dependencies.update(file_imports(collector))
+            dependencies.save()
+        runner, time_testing = run_tests(config, tests, printer)
+        summarise(config, printer, runner, time_testing, time_loading)
+
+
+def recollect(collector, filepaths, printer):
+    '''Collect filepaths again, along with any file using the shared
+    groups they define. Returns the tests collected.'''
+    pending = list(filepaths)
+    done = set()
+    tests = []
+    while len(pending) > 0:
+        filepath = pending.pop(0)
+        if filepath in done:
+            continue
+        done.add(filepath)
+        collector.forget(filepath)
+        try:
+            collector.collect_from_file(filepath)
+        except Exception:
+            printer.red(traceback.format_exc(), raw=True)
+            continue
+        collected = collector.files[filepath]
+        tests.extend(collected.tests)
+        if len(collected.shared) > 0:
+            for other in sorted(collector.files):
+                if collector.files[other].uses & collected.shared:
+                    pending.append(other)
+    return tests
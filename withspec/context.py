@@ -1,5 +1,6 @@
+import sys
 import logging
-from .assertions import Assertions
+from .assertions import get_assertor
 from .registry import get_registry
 from .elements import (
     ContextElement,
@@ -8,28 +9,44 @@ from .elements import (
     AfterElement,
     FixtureElement,
     TestElement,
+    test_element,
 )
 
 
 log = logging.getLogger(__name__)
 
+ELEMENT_KINDS = {
+    'before': BeforeElement,
+    'after': AfterElement,
+    'fixture': FixtureElement,
+}
+
 
 class Context(object):
     is_shared = False
-    def __init__(self, name, parent=None):
+    def __init__(self, name, parent=None, thread_safe=False):
         self.parent = parent
+        self.is_thread_safe = thread_safe
         self.children = []
         self.name = name
         self.elements = []
         self.behaviour_names = []
+        self.kinds = None  # Known element kinds, from the collection cache
+        self.line = None      # Where our `with` block starts
+        self.filename = None  # And in which file
+        self._fixture_index = None
+        self._stacks = {}
         if parent is not None:
             parent.children.append(self)
 
     def __enter__(self):
         log.debug('Entering Context: %s', self.name)
+        frame = sys._getframe(1)
+        self.line = frame.f_lineno
+        self.filename = frame.f_code.co_filename
         registry = get_registry()
         registry.add_context(self)
-        return Assertions()
+        return get_assertor()
 
     def __exit__(self, ext, exv, tb):
         log.debug('Exiting Context: %s', self.name)
@@ -45,6 +62,14 @@ class Context(object):
         else:
             return None
 
+    def thread_safe(self):
+        # As are all our children, if we are
+        if self.is_thread_safe:
+            return True
+        elif self.parent is not None:
+            return self.parent.thread_safe()
+        return False
+
     def behaves_like(self, name):
         # Add a shared 'group' to this context for processing later
         self.behaviour_names.append(name)
@@ -61,7 +86,12 @@ class Context(object):
         self.elements.append(element)
         return element
 
-    def finalise(self):
+    def finalise(self, kinds=None):
+        '''Organise the elements into before, after, fixtures and tests.
+
+        kinds optionally maps element keys to a kind, as returned by
+        `element_kinds`, which is used in place of inspecting arguments.
+        '''
         organised = {
             'before': [],
             'after': [],
@@ -80,12 +110,20 @@ class Context(object):
             key = element.key
             if isinstance(element, UnknownElement):
                 # Identify the explicit elements
-                if key == 'before':
+                if kinds is not None:
+                    kind = kinds.get(key, 'test')
+                    if kind != 'test':
+                        element = ELEMENT_KINDS[kind](element)
+                elif key == 'before':
                     element = BeforeElement(element)
                 elif key == 'after':
                     element = AfterElement(element)
-                elif key in self.fixture_keys:
+                elif key in self.fixture_keys or \
+                     getattr(element.actual, 'withspec_fixture', False):
                     element = FixtureElement(element)
+                if isinstance(element, UnknownElement):
+                    # Saves wrapping it again when it is built
+                    element = test_element(element)
 
             if isinstance(element, BeforeElement):
                 organised['before'].append(element)
@@ -96,6 +134,20 @@ class Context(object):
             else:
                 organised['tests'].append(element)
         self.elements = organised
+        self.forget_stacks()
+
+    def element_kinds(self):
+        '''Map each of our element keys to the kind of element it became'''
+        kinds = {}
+        for element in self.elements['tests']:
+            kinds[element.key] = 'test'
+        for key in self.elements['fixtures']:
+            kinds[key] = 'fixture'
+        for element in self.elements['before']:
+            kinds[element.key] = 'before'
+        for element in self.elements['after']:
+            kinds[element.key] = 'after'
+        return kinds
 
     def resolve_fixtures(self, fixture_keys):
         '''Given a set of fixture keys that may be referenced, check that
@@ -110,30 +162,64 @@ class Context(object):
         if fixture is not None:
             self.elements['tests'].remove(test)
             self.elements['fixtures'][fixture.key] = fixture
+            self.forget_stacks()
+
+    def forget_stacks(self):
+        '''Drop what we have cached about resolving fixtures, here and in
+        every child context, as it depends on our fixtures'''
+        self._fixture_index = None
+        self._stacks = {}
+        for child in self.children:
+            child.forget_stacks()
+
+    def fixture_index(self):
+        '''Map the name of every fixture visible from this context to the
+        nearest one, flattened over our parents'''
+        if self._fixture_index is None:
+            index = {}
+            if self.parent is not None:
+                index.update(self.parent.fixture_index())
+            index.update(self.elements['fixtures'])
+            self._fixture_index = index
+        return self._fixture_index
 
     def fixture_resolver(self):
+        index = self.fixture_index()
         found = set()
         def resolve(arg):
-            '''Given a single argument name, traverse the context stack for
-            a fixture with the correct name.
+            '''Given a single argument name, find the fixture with the
+            correct name, yielding the fixtures it needs before it.
             Only return the fixture
             '''
             if arg in found:
                 return
-            context = self
-            while context is not None:
-                fixture = context.elements['fixtures'].get(arg, None)
-                if fixture is not None:
-                    found.add(fixture.name)  # Stop the double recursion
-                    for arg in fixture.args:
-                        for sub_fixture in resolve(arg):
-                            yield sub_fixture
-                    yield fixture
-                    break
-                context = context.parent
+            fixture = index.get(arg, None)
+            if fixture is not None:
+                found.add(arg)  # Stop the double recursion
+                for arg in fixture.args:
+                    for sub_fixture in resolve(arg):
+                        yield sub_fixture
+                yield fixture
 
         return resolve
 
+    def stack_for(self, args):
+        '''Return the elements to run before and after a test in this
+        context which takes args (a tuple), in the order to run them.
+
+        Siblings often take the same arguments, so this is cached.
+        '''
+        stack = self._stacks.get(args, None)
+        if stack is None:
+            resolver = self.fixture_resolver()
+            before = list(self.before_stack(resolver))
+            for arg in args:
+                for fixture in resolver(arg):
+                    before.append(fixture)
+            after = list(self.after_stack(resolver))
+            stack = self._stacks[args] = (tuple(before), tuple(after))
+        return stack
+
     def before_stack(self, resolver):
         if self.parent is not None:
             for element in self.parent.before_stack(resolver):
@@ -181,6 +267,9 @@ class SharedExamples(Context):
         context.behaviour_names = self.behaviour_names[:]
         for element in self.elements:
             new_element = UnknownElement(element)
+            # Ours were only copied, and mustn't keep the copy (and the
+            # file using us) alive
+            element.became = None
             new_element.context = context
             context.elements.append(new_element)
 
@@ -1,4 +1,5 @@
 from .context import Description, Context, SharedExamples
+from .elements import SCOPES
 from .registry import get_registry
 
 
@@ -30,3 +31,51 @@ def it_behaves_like(name, **kwargs):
     registry = get_registry()
     context = registry.current_context()
     context.behaves_like(name, **kwargs)
+
+
+def tag(*tags):
+    '''Tag a test. Those tagged `skip` are skipped, and those tagged
+    `threadsafe` may be run in a thread pool with --threads.'''
+    def mark(func):
+        func.withspec_tags = getattr(func, 'withspec_tags', ()) + tags
+        return func
+    return mark
+
+
+def examples(table, names=None, title=None):
+    '''Run a test once for each row of table, with the row's values as
+    the arguments named for them (instead of fixtures).
+
+    Rows are mappings of argument names to values, or with names given,
+    sequences of values in that order. Each row is reported as the
+    test's name followed by its values, or as title formatted with them.
+    The table is kept, so it can be any iterable.
+    '''
+    table = tuple(table)
+    if names is not None:
+        names = tuple(names)
+    def mark(func):
+        func.withspec_examples = (table, names, title)
+        return func
+    return mark
+
+
+def fixture(func=None, scope='test'):
+    '''Mark a function as a fixture, even if nothing references it yet.
+
+    A fixture scoped to the `context` is executed once, and shared by every
+    test under the context defining it. One scoped to the `session` is
+    shared by the whole run. If a fixture is a generator, what it yields
+    is the value, and it is resumed to tear down once the test (or for a
+    wider scope, the last test using it) has finished.
+    '''
+    if scope not in SCOPES:
+        raise ValueError('Unknown fixture scope `%s`, expected one of %s' %
+                         (scope, ', '.join(SCOPES)))
+    def mark(func):
+        func.withspec_fixture = True
+        func.withspec_scope = scope
+        return func
+    if func is not None:
+        return mark(func)
+    return mark
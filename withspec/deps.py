@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import logging
+import builtins
+import importlib
+from importlib.util import resolve_name
+from .cache import write_atomic
+
+log = logging.getLogger(__name__)
+
+
+class ImportTracker(object):
+    '''Records the imports made while spec files are being executed.
+
+    Imports made directly by a spec file are kept against that file, and
+    every other import becomes an edge between two modules. The modules a
+    spec file depends on are then everything reachable from its direct
+    imports, which still works when a module was first imported (and so
+    only executed) by an earlier spec file.
+
+    Both the import statement, through builtins.__import__, and
+    importlib.import_module are tracked.
+    '''
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.getcwd())
+        self.edges = {}  # module name -> names of the modules it imports
+        self.namespace = None
+        self.direct = None
+        self._import = builtins.__import__
+        self._import_module = importlib.import_module
+
+    def __call__(self, namespace):
+        '''Track the imports made from namespace, a spec file's globals'''
+        self.namespace = namespace
+        self.direct = set()
+        return self
+
+    def __enter__(self):
+        self._import = builtins.__import__
+        self._import_module = importlib.import_module
+        builtins.__import__ = self.hook
+        importlib.import_module = self.import_module
+        return self.direct
+
+    def __exit__(self, exc, exv, tb):
+        builtins.__import__ = self._import
+        importlib.import_module = self._import_module
+        self.namespace = None
+        return False
+
+    def hook(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = self._import(name, globals, locals, fromlist, level)
+        if globals is not None:
+            try:
+                self.record(name, globals, fromlist, level)
+            except Exception as ex:
+                log.debug('Could not track import of %s: %s', name, ex)
+        return module
+
+    def import_module(self, name, package=None):
+        '''Stands in for importlib.import_module. Anything importing it
+        while we are tracking keeps us, so we pass through afterwards.'''
+        module = self._import_module(name, package)
+        if self.namespace is not None:
+            try:
+                # Recorded against whoever called us
+                globals = sys._getframe(1).f_globals
+                self.record(resolve_name(name, package), globals, (), 0)
+            except Exception as ex:
+                log.debug('Could not track import of %s: %s', name, ex)
+        return module
+
+    def record(self, name, globals, fromlist, level):
+        if level > 0:
+            package = globals.get('__package__') or globals['__name__']
+            name = resolve_name('.' * level + name, package)
+        # Importing a.b.c runs every package on the way
+        parts = name.split('.')
+        imported = set('.'.join(parts[:i + 1]) for i in range(len(parts)))
+        for item in fromlist or ():
+            if '%s.%s' % (name, item) in sys.modules:
+                imported.add('%s.%s' % (name, item))
+
+        if globals is self.namespace:
+            self.direct.update(imported)
+        else:
+            importer = globals.get('__name__')
+            self.edges.setdefault(importer, set()).update(imported)
+
+    def files(self, names):
+        '''Return the project source files of the named modules, and of
+        everything they import in turn'''
+        seen = set()
+        pending = list(names)
+        files = set()
+        while len(pending) > 0:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            filename = self.project_file(sys.modules.get(name))
+            if filename is None:
+                continue  # Not ours, so don't follow it either
+            files.add(filename)
+            pending.extend(self.edges.get(name, ()))
+        return files
+
+    def reload_order(self, names):
+        '''Return the modules to reload once the named ones have changed.
+        That is those, and every project module importing them, with
+        each listed after what it imports.'''
+        affected = set(names)
+        grown = True
+        while grown:
+            grown = False
+            for importer, imported in self.edges.items():
+                if importer in affected or affected.isdisjoint(imported):
+                    continue
+                if self.project_file(sys.modules.get(importer)) is not None:
+                    affected.add(importer)
+                    grown = True
+
+        order = []
+        done = set()
+        def visit(name):
+            if name in done:
+                return
+            done.add(name)
+            for imported in sorted(self.edges.get(name, ())):
+                if imported in affected:
+                    visit(imported)
+            order.append(name)
+        for name in sorted(affected):
+            visit(name)
+        return order
+
+    def project_file(self, module):
+        filename = getattr(module, '__file__', None)
+        if filename is None:
+            return None
+        filename = os.path.abspath(filename)
+        if not filename.startswith(self.root + os.sep):
+            return None
+        if 'site-packages' in filename.split(os.sep):
+            return None
+        return filename
+
+
+class DependencyMap(object):
+    '''The project files each spec file depended on when last collected,
+    persisted in the cache directory'''
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+    @classmethod
+    def load(cls, directory):
+        dependencies = cls(os.path.join(directory, 'dependencies.json'))
+        try:
+            with open(dependencies.path, 'r') as fh:
+                dependencies.files = json.load(fh)
+        except (OSError, ValueError):
+            pass
+        return dependencies
+
+    def save(self):
+        data = json.dumps(self.files, indent=0, sort_keys=True)
+        try:
+            write_atomic(self.path, data.encode('utf-8'))
+        except OSError as ex:
+            log.warning('Unable to save spec dependencies: %s', ex)
+
+    def update(self, files):
+        '''files maps spec file paths to the files they import'''
+        for filepath, imports in files.items():
+            self.files[os.path.abspath(filepath)] = sorted(imports)
+
+    def select(self, files, changed):
+        '''Filter files, (filepath, line) tuples, to those which are
+        themselves changed, or import something changed. Files we know
+        nothing about are always selected.'''
+        changed = set(os.path.abspath(filepath) for filepath in changed)
+        selected = []
+        for filepath, line in files:
+            abspath = os.path.abspath(filepath)
+            imports = self.files.get(abspath)
+            if abspath in changed or imports is None or \
+               not changed.isdisjoint(imports):
+                selected.append((filepath, line))
+        return selected
+
+
+def git_changed_files(revisions):
+    '''Return the absolute paths of the files changed in a git revision
+    range, as understood by `git diff`. Raises ValueError if git isn't
+    installed or fails, say as we aren't in a repository.'''
+    root = git('rev-parse', '--show-toplevel').strip()
+    names = git('diff', '--name-only', revisions, '--')
+    return [os.path.join(root, name) for name in names.splitlines()
+            if len(name) > 0]
+
+
+def git(*args):
+    import subprocess
+    try:
+        return subprocess.check_output(('git',) + args,
+                                       stderr=subprocess.PIPE,
+                                       universal_newlines=True)
+    except OSError as ex:
+        raise ValueError('Unable to run git: %s' % ex)
+    except subprocess.CalledProcessError as ex:
+        raise ValueError('git %s failed: %s' % (args[0],
+                                               ex.stderr.strip()))
@@ -1,10 +1,20 @@
+import time
 import inspect
 import logging
-from .util import arg_names
-from .assertions import Assertions, AssertionSubject
+import threading
+from collections.abc import Mapping
+from .util import arg_names, is_async
+from .assertions import AssertionSubject, get_assertor
+from .loop import EventLoop
 
 log = logging.getLogger(__name__)
 
+# Most tests have no tags, and can share them
+NO_TAGS = frozenset()
+
+# From the narrowest to the widest
+SCOPES = ('test', 'context', 'session')
+
 
 class ContextElement(object):
     '''Wrapper Class for any type of 'thing' a Context may need
@@ -16,7 +26,14 @@ class ContextElement(object):
         test
         fixture/let
     And can wrap either a function/class/method.
+
+    There are a great many of us, so we are slotted and keep our
+    arguments as a tuple.
     '''
+    __slots__ = ('key', 'name', 'context', 'actual', 'args', 'became',
+                 '__weakref__')
+    scope = 'test'
+
     def __init__(self, *args, **kwargs):
         if len(args) > 1:
             raise TypeError('%s() cannot take more than one positional ' \
@@ -41,7 +58,7 @@ class ContextElement(object):
             if self.actual is not None:
                 self.args = arg_names(self.actual)
             else:
-                self.args = []
+                self.args = ()
 
         self.became = None
 
@@ -74,6 +91,11 @@ class ContextElement(object):
 
     def definition(self):
         '''Return where this element is defined'''
+        if self.actual is None:
+            return None
+        code = getattr(self.actual, '__code__', None)
+        if code is not None:
+            return '%s:%s' % (code.co_filename, code.co_firstlineno)
         lines, lineno = inspect.getsourcelines(self.actual)
         return '%s:%s' % (self.filename(), lineno)
 
@@ -85,89 +107,489 @@ class ContextElement(object):
 
 
 class BeforeElement(ContextElement):
-    def execute(self, arguments):
-        kwargs = {}
-        for arg in self.args:
-            kwargs[arg] = arguments.get(arg, None)
-        return self.actual(**kwargs)
+    __slots__ = ()
 
 
 class AfterElement(ContextElement):
-    def execute(self, arguments):
-        kwargs = {}
-        for arg in self.args:
-            kwargs[arg] = arguments.get(arg, None)
-        return self.actual(**kwargs)
+    __slots__ = ()
 
 
 class FixtureElement(ContextElement):
-    def execute(self, arguments):
-        kwargs = {}
-        for arg in self.args:
-            kwargs[arg] = arguments.get(arg, None)
-        return self.actual(**kwargs)
-
+    __slots__ = ('scope',)
 
-class TestElement(ContextElement):
     def __init__(self, *args, **kwargs):
-        self.tags = set()
-        for tag in kwargs.pop('tags', []):
-            self.tags.add(tag)
-        super(TestElement, self).__init__(*args, **kwargs)
+        super(FixtureElement, self).__init__(*args, **kwargs)
+        # Set by the `fixture` decorator
+        self.scope = getattr(self.actual, 'withspec_scope', 'test')
 
-    def execute(self, arguments):
-        # Run just the single executable.
-        # Arguments should have been gathered and provided
-        # (Generally by `run` below)
 
-        log.info('Executing Test %s' % self.name)
-        kwargs = {}
-        assertor = Assertions()
-        if 'test' in self.args and 'test' not in arguments:
-            arguments['test'] = assertor
+class TestElement(ContextElement):
+    # Everything from stack on is set once we are built
+    __slots__ = ('tags', 'stack', 'plan', 'awaits', 'generators',
+                 'position', 'assertor_needed', 'result_index', 'error')
+    names = ()  # Of the arguments given by each row of examples
 
-        for arg in self.args:
-            value = arguments.get(arg, None)
-            if value is None:
-                log.warn('Could not resolve argument `%s` for `%s`', 
-                         arg, self.name)
-            kwargs[arg] = value
+    def __init__(self, *args, **kwargs):
+        tags = tuple(kwargs.pop('tags', ()))
+        super(TestElement, self).__init__(*args, **kwargs)
+        # Set by the `tag` decorator
+        tags += getattr(self.actual, 'withspec_tags', ())
+        self.tags = frozenset(tags) if len(tags) > 0 else NO_TAGS
 
-        if 'result' in self.args:
-            kwargs['result'] = AssertionSubject(assertor, kwargs['result'])
+    def thread_safe(self):
+        return 'threadsafe' in self.tags or self.context.thread_safe()
 
-        return self.actual(**kwargs)
+    def spec_file(self):
+        '''Return the spec file we were collected from. Unlike our
+        definition, this isn't where a shared group was defined.'''
+        return self.parents()[0].filename
 
-    def run(self):
+    def run(self, scopes=None, timings=None, row=()):
         # Used to 'run' this test within its build
-        responses = {}
-        for element in self.stack:
-            responses[element.key] = element.execute(responses)
+        # Fixtures scoped wider than a test are held by `scopes`, which
+        # the runner shares between tests. Alone, we hold them ourselves.
+        # If given a list of timings, (element, wall, cpu) is appended to
+        # it for each step. row holds the values of `names`.
+        alone = scopes is None
+        if alone:
+            scopes = ScopedFixtures()
+        generators = []  # (fixture, generator) of our own to resume
+        try:
+            if self.error is not None:
+                raise ValueError(self.error)
+            if len(self.awaits) > 0:
+                scopes.loop.run(self.run_async(scopes, timings, row))
+                return
+            # One slot per step, then one always None for missing
+            # arguments, then one for the assertor, then the row
+            assertor = len(self.plan) + 1
+            values = [None] * (assertor + 1)
+            values.extend(row)
+            if self.assertor_needed:
+                values[assertor] = get_assertor()
+            for index, (element, actual, slots) in enumerate(self.plan):
+                if timings is not None:
+                    wall = time.perf_counter()
+                    cpu = time.process_time()
+                args = [values[slot] for slot in slots]
+                if index == self.position:
+                    log.info('Executing Test %s' % self.name)
+                    if self.result_index is not None:
+                        args[self.result_index] = AssertionSubject(
+                            values[assertor], args[self.result_index])
+                if element.scope != 'test':
+                    # Timed by scopes, only when it is actually set up
+                    values[index] = scopes.value(element, args, timings)
+                    continue
+                elif index in self.generators:
+                    generator = actual(*args)
+                    generators.append((element, generator))
+                    values[index] = next(generator)
+                else:
+                    values[index] = actual(*args)
+                if timings is not None:
+                    timings.append((element,
+                                    time.perf_counter() - wall,
+                                    time.process_time() - cpu))
+        finally:
+            for element, generator in reversed(generators):
+                finish_generator(element, generator)
+            if alone:
+                scopes.close()
+
+    async def run_async(self, scopes, timings=None, row=()):
+        '''As `run`, but as a coroutine which awaits the coroutine steps
+        of the plan, and any asynchronous scoped fixtures'''
+        if self.error is not None:
+            raise ValueError(self.error)
+        assertor = len(self.plan) + 1
+        values = [None] * (assertor + 1)
+        values.extend(row)
+        if self.assertor_needed:
+            values[assertor] = get_assertor()
+        generators = []  # (fixture, generator) of our own to resume
+        try:
+            for index, (element, actual, slots) in enumerate(self.plan):
+                if timings is not None:
+                    wall = time.perf_counter()
+                    cpu = time.process_time()
+                args = [values[slot] for slot in slots]
+                if index == self.position:
+                    log.info('Executing Test %s' % self.name)
+                    if self.result_index is not None:
+                        args[self.result_index] = AssertionSubject(
+                            values[assertor], args[self.result_index])
+                if element.scope != 'test':
+                    values[index] = await scopes.value_async(element, args,
+                                                             timings)
+                    continue
+                elif index in self.generators:
+                    generator = actual(*args)
+                    generators.append((element, generator))
+                    values[index] = next(generator)
+                elif index not in self.awaits:
+                    values[index] = actual(*args)
+                elif inspect.isasyncgenfunction(actual):
+                    generator = actual(*args)
+                    generators.append((element, generator))
+                    values[index] = await generator.__anext__()
+                else:
+                    values[index] = await actual(*args)
+                if timings is not None:
+                    timings.append((element,
+                                    time.perf_counter() - wall,
+                                    time.process_time() - cpu))
+        finally:
+            for element, generator in reversed(generators):
+                if inspect.isasyncgen(generator):
+                    await finish_async_generator(element, generator)
+                else:
+                    finish_generator(element, generator)
 
     def build(self):
+        if self.became is not None:
+            # We turned out to be a fixture
+            return self.became.build()
         log.info('Building %s', self.fullname('->'))
         # Get ourselves ready to run
         if len(self.args) == 0:
-            self.tags.add('pending')
+            self.tags = self.tags | {'pending'}
             return self
-        resolver = self.context.fixture_resolver()
-        stack = []
-        stack += self.context.before_stack(resolver)
+        args = self.args
+        if len(self.names) > 0:
+            args = tuple(arg for arg in args if arg not in self.names)
+        before, after = self.context.stack_for(args)
+        self.stack = before + (self,) + after
+        self.compile()
+        return self
+
+    def release(self):
+        '''Drop the stack and plan built to run us, once we have been'''
+        self.stack = ()
+        self.plan = ()
+        self.awaits = frozenset()
+        self.generators = frozenset()
+
+    def compile(self):
+        '''Flatten our stack into a plan, a tuple of (element, callable,
+        slots) steps.
+
+        Each step's value is stored in the slot matching its position, and
+        its arguments are read positionally from the slots of whichever
+        elements they resolved to at that point in the stack. Every
+        argument is looked up by name here, once, rather than each run.
+        '''
+        missing = len(self.stack)
+        assertor = missing + 1
+        # Row values follow the assertor. They are ours, so take priority
+        # over any element of the stack with the same name, which only
+        # the elements that depend on it see.
+        rows = dict((name, assertor + 1 + offset)
+                    for offset, name in enumerate(self.names))
+        slots = {}
+        plan = []
+        # Why we can't be run, which only fails us, not the collection
+        self.error = None
+        for index, element in enumerate(self.stack):
+            arg_slots = []
+            for arg in element.args:
+                if element is self and arg in rows:
+                    slot = rows[arg]
+                else:
+                    slot = slots.get(arg, rows.get(arg, missing))
+                if element is self and slot == missing:
+                    if arg == 'test':
+                        slot = assertor
+                    else:
+                        log.warning('Could not resolve argument `%s` ' \
+                                    'for `%s`', arg, self.name)
+                arg_slots.append(slot)
+            if element.scope != 'test' and self.error is None:
+                self.error = self.check_scope(element, arg_slots)
+            plan.append((element, element.actual, tuple(arg_slots)))
+            if element is self and 'test' in self.args and \
+               'test' not in slots:
+                slots['test'] = assertor
+            slots[element.key] = index
+
+        self.plan = tuple(plan)
+        # The steps to await. If there are any, we run as a coroutine.
+        self.awaits = frozenset(index for index, element
+                                in enumerate(self.stack)
+                                if is_async(element.actual))
+        # Generator fixtures of our own, whose value is what they yield,
+        # resumed to tear down once we have run
+        self.generators = frozenset(
+            index for index, element in enumerate(self.stack)
+            if element is not self and element.scope == 'test' and
+            inspect.isgeneratorfunction(element.actual))
+        self.position = self.stack.index(self)
+        self.assertor_needed = 'test' in self.args or 'result' in self.args
+        self.result_index = None
+        if 'result' in self.args:
+            self.result_index = self.args.index('result')
+
+    def check_scope(self, fixture, arg_slots):
+        '''Return why fixture can't be used, if it depends on anything
+        scoped more narrowly, as its value would outlive what it was made
+        from. Otherwise None.'''
+        missing = len(self.stack)
+        for arg, slot in zip(fixture.args, arg_slots):
+            if slot < missing:
+                scope = self.stack[slot].scope
+            elif slot > missing:
+                scope = 'test'  # A row of examples
+            else:
+                continue
+            if SCOPES.index(scope) < SCOPES.index(fixture.scope):
+                return 'The %s scoped fixture `%s` cannot depend on `%s`, ' \
+                       'which is scoped to the %s' % \
+                       (fixture.scope, fixture.name, arg, scope)
+        return None
 
-        for arg in self.args:
-            for fixture in resolver(arg):
-                stack.append(fixture)
 
-        stack.append(self)
-        stack += self.context.after_stack(resolver)
-        self.stack = stack
-        return self
+class ExamplesElement(TestElement):
+    '''A test run once for each row of a table, as given by `examples`.
+
+    It is built once, and every row shares its stack and plan, with the
+    row's values in slots of their own. Each row is run and reported as
+    an `Example`, which only holds the row.
+    '''
+    __slots__ = ('names', 'table', 'mappings', 'title')
+
+    def __init__(self, *args, **kwargs):
+        super(ExamplesElement, self).__init__(*args, **kwargs)
+        # Set by the `examples` decorator
+        self.table, names, self.title = self.actual.withspec_examples
+        self.mappings = names is None
+        if self.mappings:
+            names = ()
+            if len(self.table) > 0 and isinstance(self.table[0], Mapping):
+                names = tuple(self.table[0])
+        self.names = names
+
+    def expand(self):
+        '''Yield an `Example` for each row'''
+        if 'pending' in self.tags:
+            yield self
+            return
+        for row in self.table:
+            yield Example(self, row)
+
+    def values(self, row):
+        '''Return the values of row, in the order of our names. Raises
+        ValueError if it doesn't have one for each of them.'''
+        values = None
+        if isinstance(row, Mapping) == self.mappings:
+            try:
+                if self.mappings:
+                    values = tuple(row[name] for name in self.names)
+                else:
+                    values = tuple(row)
+            except (KeyError, TypeError):
+                pass
+        if values is None or len(values) != len(self.names):
+            raise ValueError('Row %r of examples for `%s` does not give '
+                             'each of %s' % (row, self.name,
+                                             ', '.join(self.names)))
+        return values
+
+    def title_for(self, values):
+        return self.title.format(**dict(zip(self.names, values)))
+
+    def row_name(self, row):
+        '''Name a row. As it is reported, a row that doesn't fit the table
+        or title is named as it is, and fails when run instead.'''
+        try:
+            values = self.values(row)
+            if self.title is not None:
+                return self.title_for(values)
+        except Exception:
+            return '%s [%r]' % (self.name, row)
+        return '%s [%s]' % (self.name, ', '.join(
+            '%s=%r' % pair for pair in zip(self.names, values)))
+
+
+class Example(object):
+    '''A row of an `ExamplesElement`, standing in for a test of its own.
+    Anything but its name and how it is run is the element's.'''
+    __slots__ = ('element', 'row')
+
+    def __init__(self, element, row):
+        self.element = element
+        self.row = row
+
+    @property
+    def name(self):
+        # Only worked out when asked for, such as when reported
+        return self.element.row_name(self.row)
+
+    def __getattr__(self, name):
+        return getattr(self.element, name)
+
+    def fullname(self, spacer=' '):
+        parents = spacer.join([i.name for i in self.parents()])
+        return '%s%s%s' % (parents, spacer, self.name)
+
+    def row_values(self):
+        '''The values of our row, raising if it doesn't fit the table or
+        the title, which `name` would rather not'''
+        values = self.element.values(self.row)
+        if self.element.title is not None:
+            self.element.title_for(values)
+        return values
+
+    def run(self, scopes=None, timings=None):
+        self.element.run(scopes, timings, self.row_values())
+
+    async def run_async(self, scopes, timings=None):
+        await self.element.run_async(scopes, timings, self.row_values())
+
+    def release(self):
+        pass  # The plan is shared with the other rows
+
+
+def test_element(element):
+    '''Make a test of an element, or one run for each of its examples'''
+    if hasattr(element.actual, 'withspec_examples'):
+        return ExamplesElement(element)
+    return TestElement(element)
 
 
 class UnknownElement(ContextElement):
+    __slots__ = ()
+
     def build(self):
         if self.became is not None:
             return self.became.build()
-        return TestElement(self).build()
-
-
+        return test_element(self).build()
+
+
+def finish_generator(fixture, generator):
+    '''Resume a generator fixture to tear it down'''
+    try:
+        next(generator)
+    except StopIteration:
+        pass
+    except Exception:
+        log.exception('Tearing down fixture `%s` failed', fixture.fullname())
+    else:
+        log.error('Fixture `%s` yielded more than once', fixture.fullname())
+        generator.close()
+
+
+async def finish_async_generator(fixture, generator):
+    '''Resume an asynchronous generator fixture to tear it down'''
+    try:
+        await generator.__anext__()
+    except StopAsyncIteration:
+        pass
+    except Exception:
+        log.exception('Tearing down fixture `%s` failed', fixture.fullname())
+    else:
+        log.error('Fixture `%s` yielded more than once', fixture.fullname())
+        await generator.aclose()
+
+
+class ScopedFixtures(object):
+    '''Holds the values of fixtures scoped to a context, or to the whole
+    run, so they are only executed once.
+
+    Generator fixtures are torn down by resuming them once the last test
+    expected to use them has finished (or on `close` for the session).
+
+    As they outlive any one test, the event loop for coroutine tests and
+    fixtures is kept here too.
+    '''
+    def __init__(self):
+        self.values = {}     # fixture -> value
+        self.teardowns = {}  # fixture -> generator to resume
+        self.remaining = {}  # context scoped fixture -> tests yet to finish
+        self.loop = EventLoop()
+        # Thread safe tests may want the same fixture at once
+        self.lock = threading.Lock()
+
+    def expect(self, tests):
+        '''Count the tests that will use each context scoped fixture.
+        If any are coroutines, the event loop is started now, rather than
+        while the first is run (and its logs are captured).'''
+        for test in tests:
+            if len(getattr(test, 'awaits', ())) > 0:
+                self.loop.start()
+            for element in getattr(test, 'stack', ()):
+                if element.scope == 'context':
+                    self.remaining[element] = \
+                        self.remaining.get(element, 0) + 1
+
+    def value(self, fixture, args, timings=None):
+        '''Return the value of fixture, executing it with args (positional
+        arguments, in the order of `fixture.args`) the first time.
+
+        If given a list of timings, (fixture, wall, cpu) is appended to it
+        when the fixture is executed, but not when it is only looked up.
+        '''
+        if fixture not in self.values:
+            with self.lock:
+                if fixture not in self.values:
+                    log.debug('Setting up %s fixture `%s`', fixture.scope,
+                              fixture.name)
+                    if timings is not None:
+                        wall = time.perf_counter()
+                        cpu = time.process_time()
+                    value = fixture.actual(*args)
+                    if inspect.isgeneratorfunction(fixture.actual):
+                        self.teardowns[fixture] = value
+                        value = next(value)
+                    self.values[fixture] = value
+                    if timings is not None:
+                        timings.append((fixture,
+                                        time.perf_counter() - wall,
+                                        time.process_time() - cpu))
+        return self.values[fixture]
+
+    async def value_async(self, fixture, args, timings=None):
+        '''As `value`, but for use from a coroutine test, so coroutine and
+        asynchronous generator fixtures can be awaited'''
+        if fixture not in self.values and is_async(fixture.actual):
+            log.debug('Setting up %s fixture `%s`', fixture.scope,
+                      fixture.name)
+            if timings is not None:
+                wall = time.perf_counter()
+                cpu = time.process_time()
+            if inspect.isasyncgenfunction(fixture.actual):
+                generator = fixture.actual(*args)
+                self.teardowns[fixture] = generator
+                self.values[fixture] = await generator.__anext__()
+            else:
+                self.values[fixture] = await fixture.actual(*args)
+            if timings is not None:
+                timings.append((fixture,
+                                time.perf_counter() - wall,
+                                time.process_time() - cpu))
+        return self.value(fixture, args, timings)
+
+    def finished(self, test):
+        for element in getattr(test, 'stack', ()):
+            if element in self.remaining:
+                self.remaining[element] -= 1
+                if self.remaining[element] == 0:
+                    del self.remaining[element]
+                    self.teardown(element)
+
+    def teardown(self, fixture):
+        self.values.pop(fixture, None)
+        generator = self.teardowns.pop(fixture, None)
+        if generator is None:
+            return
+        log.debug('Tearing down %s fixture `%s`', fixture.scope, fixture.name)
+        if inspect.isasyncgen(generator):
+            self.loop.run(finish_async_generator(fixture, generator))
+        else:
+            finish_generator(fixture, generator)
+
+    def close(self):
+        '''Tear down everything still held'''
+        for fixture in list(self.values):
+            self.teardown(fixture)
+        self.remaining.clear()
+        self.loop.close()
@@ -0,0 +1,137 @@
+import os
+import json
+import random
+import logging
+from .cache import write_atomic
+
+log = logging.getLogger(__name__)
+
+
+def test_key(test):
+    '''Identify a test between runs. Names alone can repeat in different
+    files, and definitions repeat for shared groups, so we need both.'''
+    definition = test.definition()
+    if definition is not None:
+        filename, line = definition.rsplit(':', 1)
+        definition = '%s:%s' % (os.path.abspath(filename), line)
+    return '%s %s' % (definition, test.fullname())
+
+
+class History(object):
+    '''The status and duration of each test when it was last run,
+    persisted in the cache directory'''
+    def __init__(self, path):
+        self.path = path
+        self.results = {}  # test_key -> [status, duration, spec file]
+
+    @classmethod
+    def load(cls, directory):
+        history = cls(os.path.join(directory, 'results.json'))
+        try:
+            with open(history.path, 'r') as fh:
+                results = json.load(fh)
+            # Ignore anything from before spec files were kept
+            history.results = dict((key, result)
+                                   for key, result in results.items()
+                                   if len(result) == 3)
+        except (OSError, ValueError):
+            pass
+        return history
+
+    def save(self):
+        data = json.dumps(self.results, indent=0, sort_keys=True)
+        try:
+            write_atomic(self.path, data.encode('utf-8'))
+        except OSError as ex:
+            log.warning('Unable to save test results: %s', ex)
+
+    def record(self, test, status, duration):
+        if status in ('passed', 'failed'):
+            spec_file = test.spec_file()
+            if spec_file is not None:
+                spec_file = os.path.abspath(spec_file)
+            self.results[test_key(test)] = [status, duration, spec_file]
+
+    def failed(self, tests):
+        '''Return those of tests which failed last time they were run'''
+        failed = []
+        for test in tests:
+            result = self.results.get(test_key(test))
+            if result is not None and result[0] == 'failed':
+                failed.append(test)
+        return failed
+
+    def failed_files(self):
+        '''Return the spec files with a test which failed last time'''
+        return set(spec_file for status, duration, spec_file
+                   in self.results.values()
+                   if status == 'failed' and spec_file is not None)
+
+    def order(self, tests):
+        '''Sort tests in place, with those that failed last time first and
+        then the quickest. Those we've not seen are assumed to be quick.'''
+        def key(test):
+            status, duration, spec_file = self.results.get(
+                test_key(test), (None, None, None))
+            return (status != 'failed', duration or 0.0)
+        tests.sort(key=key)
+
+    def file_durations(self):
+        '''Return the total duration of the tests in each spec file'''
+        durations = {}
+        for status, duration, spec_file in self.results.values():
+            if spec_file is not None:
+                durations[spec_file] = \
+                    durations.get(spec_file, 0.0) + (duration or 0.0)
+        return durations
+
+
+def shard_files(files, index, count, durations=None):
+    '''Return the share of files, (filepath, line) tuples, for shard index
+    (from 0) of count.
+
+    With durations, as from `History.file_durations`, each file in turn
+    from the slowest goes to the shard with the least time so far. Files
+    without a duration are assumed to take the average. Otherwise they
+    are dealt out round robin.
+    '''
+    files = sorted(files, key=lambda location: location[0])
+    known = [durations[os.path.abspath(filepath)]
+             for filepath, line in files
+             if os.path.abspath(filepath) in (durations or {})]
+    if len(known) == 0:
+        return files[index::count]
+    average = sum(known) / len(known)
+    def duration(location):
+        return durations.get(os.path.abspath(location[0]), average)
+    totals = [0.0] * count
+    shares = [[] for i in range(count)]
+    for location in sorted(files, key=lambda location: -duration(location)):
+        shard = totals.index(min(totals))
+        totals[shard] += duration(location)
+        shares[shard].append(location)
+    log.debug('Shard durations: %s', totals)
+    return sorted(shares[index], key=lambda location: location[0])
+
+
+def order_tests(config, tests, history=None, fallback=True):
+    '''Order (or filter) tests in place, as configured.
+
+    If none of tests failed last time, --last-failed runs them all, unless
+    fallback is False. That is for when they are only a share of the run,
+    which has already decided there are failures to run elsewhere.
+    '''
+    if config['order'] == 'random':
+        random.seed(config['seed'])
+        random.shuffle(tests)
+    if config['order'] == 'failed' or config['last_failed']:
+        if history is None:
+            history = History.load(config['cache_dir'])
+        if config['last_failed']:
+            failed = history.failed(tests)
+            if len(failed) > 0 or not fallback:
+                tests[:] = failed
+            else:
+                log.warning('No tests failed last time, running them all')
+        if config['order'] == 'failed':
+            history.order(tests)
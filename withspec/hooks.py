@@ -1,81 +1,150 @@
 import sys
 import os
 import logging
-from traceback import extract_tb
+import threading
+from traceback import StackSummary, walk_tb
+from contextvars import ContextVar
 from io import StringIO
 
 log = logging.getLogger(__name__)
 
 
+class CapturedOutput(object):
+    '''Output captured during a single test.
+
+    The buffers are kept as they are, and only split in to lines when
+    iterated over, which only happens if the test failed or a reporter
+    wants its output.
+    '''
+    def __init__(self, *sections):
+        self.sections = sections  # (title, buffer) pairs
+
+    def __iter__(self):
+        for title, buffer in self.sections:
+            yield title
+            for line in buffer.getvalue().splitlines():
+                yield line.strip()
+
+
+class ContextStream(object):
+    '''Stands in for a stream, such as sys.stdout, writing instead to the
+    buffer set for the current context, if any.
+
+    Tests run concurrently, whether as coroutines or in threads, each have
+    a context of their own, so this way each captures only what it wrote
+    itself.
+    '''
+    def __init__(self, stream, buffer):
+        self.stream = stream
+        self.buffer = buffer  # ContextVar holding the buffer, or None
+
+    def target(self):
+        buffer = self.buffer.get()
+        if buffer is None:
+            return self.stream
+        return buffer
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+
+class ContextHandler(logging.Handler):
+    '''Formats records to the buffer set for the current context, if any'''
+    def __init__(self, buffer):
+        logging.Handler.__init__(self)
+        self.buffer = buffer
+
+    def emit(self, record):
+        buffer = self.buffer.get()
+        if buffer is None:
+            return
+        try:
+            buffer.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
 class StdOutHook(object):
     def __init__(self, config):
         self.stdout = sys.stdout
         self.stderr = sys.stderr
-        self.out_buffer = StringIO()
-        self.err_buffer = StringIO()
+        self.out_buffer = ContextVar('withspec_stdout', default=None)
+        self.err_buffer = ContextVar('withspec_stderr', default=None)
+        self.running = 0  # Tests between before and after
+        self.lock = threading.Lock()
 
     def before(self, test):
-        sys.stdout = self.out_buffer
-        sys.stderr = self.err_buffer
+        with self.lock:
+            if self.running == 0:
+                sys.stdout = ContextStream(self.stdout, self.out_buffer)
+                sys.stderr = ContextStream(self.stderr, self.err_buffer)
+            self.running += 1
+        self.out_buffer.set(StringIO())
+        self.err_buffer.set(StringIO())
 
     def after(self, test, exc, exv, bt):
         # As we are restoring things to sys, 
         # We cannot be a generator
-        sys.stdout = self.stdout
-        sys.stderr = self.stderr
-
-        self.out_buffer.seek(0)
-        out = [line.strip() for line in self.out_buffer.readlines()]
-        self.err_buffer.seek(0)
-        err = [line.strip() for line in self.err_buffer.readlines()]
-
-        self.out_buffer.seek(0)
-        self.out_buffer.truncate()
-        self.err_buffer.seek(0)
-        self.err_buffer.truncate()
-
-        response = []
-        if len(out) > 0:
-            response.append('>> stdout <<')
-            response += out
-        if len(err) > 0:
-            response.append('>> stderr <<')
-            response += err
-        if len(response) > 0:
-            return response
+        with self.lock:
+            self.running -= 1
+            if self.running == 0:
+                sys.stdout = self.stdout
+                sys.stderr = self.stderr
+        out_buffer = self.out_buffer.get()
+        err_buffer = self.err_buffer.get()
+        self.out_buffer.set(None)
+        self.err_buffer.set(None)
+
+        # Anything written is handed over as is
+        sections = []
+        if out_buffer.tell() > 0:
+            sections.append(('>> stdout <<', out_buffer))
+        if err_buffer.tell() > 0:
+            sections.append(('>> stderr <<', err_buffer))
+        if len(sections) > 0:
+            return CapturedOutput(*sections)
 
 
 class LogHook(object):
     def __init__(self, config):
         self.root_logger = logging.getLogger()
-        self.buffer = StringIO()
-        self.handler = logging.StreamHandler(self.buffer)
+        self.buffer = ContextVar('withspec_logs', default=None)
+        self.handler = ContextHandler(self.buffer)
         self.handler.setFormatter(
             logging.Formatter('%(levelname)-5.6s '\
                               '[%(name)s] %(message)s')
         )
+        self.running = 0  # Tests between before and after
+        self.lock = threading.Lock()
         
     def before(self, test):
-        self.root_logger.addHandler(self.handler)
-        # We may have to clear out the handlers here ??
-        # Or let the StdOut Hook deal with it ?
-        self.level = self.root_logger.getEffectiveLevel()
-        self.root_logger.setLevel(logging.NOTSET)
+        with self.lock:
+            if self.running == 0:
+                self.root_logger.addHandler(self.handler)
+                # We may have to clear out the handlers here ??
+                # Or let the StdOut Hook deal with it ?
+                self.level = self.root_logger.getEffectiveLevel()
+                self.root_logger.setLevel(logging.NOTSET)
+            self.running += 1
+        self.buffer.set(StringIO())
 
     def after(self, test, exc, exv, bt):
-        # Restore the Level
-        self.root_logger.setLevel(self.level)
-        # Remove the Handler
-        self.root_logger.removeHandler(self.handler)
+        with self.lock:
+            self.running -= 1
+            if self.running == 0:
+                # Restore the Level
+                self.root_logger.setLevel(self.level)
+                # Remove the Handler
+                self.root_logger.removeHandler(self.handler)
 
-        # We don't use generator here, as we need to clear out the buffer
-        self.buffer.seek(0)
-        lines = [line.strip() for line in self.buffer.readlines()]
-
-        self.buffer.seek(0)
-        self.buffer.truncate()
-        if len(lines) > 0:
-            return ['>> logs <<'] + lines
+        # We don't use generator here, as we need to swap out the buffer
+        buffer = self.buffer.get()
+        self.buffer.set(None)
+        if buffer.tell() > 0:
+            return CapturedOutput(('>> logs <<', buffer))
 
 
 class TraceBackHook(object):
@@ -94,13 +163,36 @@ class TraceBackHook(object):
 
     def after(self, test, exc, exv, bt):
         if exc is not None:
-            testfile = test.filename()
-            seen_testfile = False
-            for filename, lineno, name, line in reversed(extract_tb(bt)):
-                if seen_testfile and self.exclude is not None and \
-                   filename.startswith(self.exclude):
-                    break
-                if filename == testfile:
-                    seen_testfile = True
-                yield '# %s:%d:in %s' % (filename, lineno, name)
-
+            # Where each frame was is taken now, as the frames can move on
+            # (a generator fixture is resumed to tear down) and would be
+            # kept alive. Without reading any source, that's cheap, and
+            # it is only formatted if the failure is actually read.
+            frames = StackSummary.extract(walk_tb(bt), lookup_lines=False)
+            return self.format(test.filename(), frames)
+
+    def format(self, testfile, frames):
+        seen_testfile = False
+        for frame in reversed(frames):
+            filename = frame.filename
+            if seen_testfile and self.exclude is not None and \
+               filename.startswith(self.exclude):
+                break
+            if filename == testfile:
+                seen_testfile = True
+            yield '# %s:%d:in %s' % (filename, frame.lineno, frame.name)
+
+
+def default_hooks(config):
+    '''Build the standard set of hooks for the given config'''
+    hooks = []
+    # In the future these should be configurable, so you
+    # could write a wrapper/plugin, and add it here
+
+    # Our Hooks are built in this order deliberately
+    if not config['no_logs']:
+        hooks.append(LogHook(config))
+    if not config['no_stdout']:
+        hooks.append(StdOutHook(config))
+    # TraceBackHook is mandatory, as it formats tracebacks
+    hooks.append(TraceBackHook(config))
+    return hooks
@@ -0,0 +1,54 @@
+import ast
+import logging
+from bisect import bisect_right
+
+log = logging.getLogger(__name__)
+
+
+class LineIndex(object):
+    '''The lines spanned by each function and `with` block of a spec file,
+    taken from its ast, so we can find what is defined at a line without
+    inspecting the source of every element.
+
+    Blocks are either nested or apart, so sorted by where they start the
+    innermost block holding a line is the last one starting before it, or
+    one of its outer blocks.
+    '''
+    def __init__(self, source, filename='<spec>'):
+        spans = []
+        for node in ast.walk(ast.parse(source, filename)):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                # Like co_firstlineno, a function starts at its decorators
+                start = min([node.lineno] + [decorator.lineno for decorator
+                                             in node.decorator_list])
+                spans.append((start, node.end_lineno, 'def'))
+            elif isinstance(node, (ast.With, ast.AsyncWith)):
+                spans.append((node.lineno, node.end_lineno, 'with'))
+        # Outer blocks first when two start on the same line
+        spans.sort(key=lambda span: (span[0], -span[1]))
+        self.spans = spans
+        self.starts = [span[0] for span in spans]
+        self.outer = []  # Index of the block each block is inside, or None
+        stack = []
+        for index, (start, end, kind) in enumerate(spans):
+            while len(stack) > 0 and spans[stack[-1]][1] < start:
+                stack.pop()
+            self.outer.append(stack[-1] if len(stack) > 0 else None)
+            stack.append(index)
+
+    def enclosing(self, line):
+        '''Return the (start, end, kind) of each block holding line, from
+        the innermost out'''
+        index = bisect_right(self.starts, line) - 1
+        while index is not None and index >= 0 and \
+              self.spans[index][1] < line:
+            index = self.outer[index]
+        spans = []
+        while index is not None and index >= 0:
+            spans.append(self.spans[index])
+            index = self.outer[index]
+        return spans
+
+    def following(self, line):
+        '''Return the blocks starting after line, in order'''
+        return self.spans[bisect_right(self.starts, line):]
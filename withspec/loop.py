@@ -0,0 +1,31 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class EventLoop(object):
+    '''The event loop that coroutine tests and fixtures are run on. It is
+    only created once something needs it, and then kept for the rest of
+    the run.'''
+    def __init__(self):
+        self.loop = None
+
+    def start(self):
+        if self.loop is None:
+            log.debug('Starting the event loop')
+            # Slow to import, and most runs have no coroutines
+            import asyncio
+            self.loop = asyncio.new_event_loop()
+
+    def run(self, coroutine):
+        self.start()
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        if self.loop is None:
+            return
+        try:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        finally:
+            self.loop.close()
+            self.loop = None
@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+import queue
+import random
+import logging
+import traceback
+import multiprocessing
+from collections import namedtuple
+from .cache import get_cache
+from .collector import WithSpecCollector
+from .history import History, order_tests
+from .hooks import default_hooks
+from .reporters import configured_reporters
+from .runner import WithSpecRunner
+
+log = logging.getLogger(__name__)
+
+
+# Stand in for a Context in the parent process. The printer only needs
+# the name, and compares nesting by equality, hence the path.
+ContextRecord = namedtuple('ContextRecord', ['name', 'path'])
+
+
+class RemoteTest(object):
+    '''A picklable summary of a TestElement that was run in a worker.
+
+    It provides enough of the TestElement interface for the Printer
+    and the failure report in the parent process.
+    '''
+    def __init__(self, test, status, definition=False):
+        self.name = test.name
+        self.tags = set(test.tags)
+        self._spec_file = test.spec_file()
+        self._definition = None
+        if definition or status == 'failed':
+            # Failures always report where they are defined
+            self._definition = test.definition()
+        self._parents = []
+        path = ()
+        for context in test.parents():
+            path += (context.name,)
+            self._parents.append(ContextRecord(context.name, path))
+
+    def fullname(self, spacer=' '):
+        return spacer.join([i.name for i in self._parents] + [self.name])
+
+    def parents(self):
+        return self._parents
+
+    def definition(self):
+        return self._definition
+
+    def spec_file(self):
+        return self._spec_file
+
+
+class WorkerRunner(WithSpecRunner):
+    '''Runs tests inside a worker, sharing fail fast with its siblings'''
+    def __init__(self, hooks, abort, keep_output=False, **kwargs):
+        WithSpecRunner.__init__(self, hooks, **kwargs)
+        self.abort = abort
+        # Our parent's reporters want output from every test
+        self.keep_output = keep_output
+
+    def stopped(self):
+        return self.fail_fast and self.abort.is_set()
+
+
+def split_files(files, jobs, seed=None):
+    '''Deal the files out round robin, so each worker gets a similar share
+    of each directory. Given a seed, they are shuffled first, so that it
+    also decides which files share a worker.'''
+    files = sorted(files)
+    if seed is not None:
+        random.Random(seed).shuffle(files)
+    shares = [[] for i in range(jobs)]
+    for i, location in enumerate(files):
+        shares[i % jobs].append(location)
+    return [share for share in shares if len(share) > 0]
+
+
+def worker_configs(config, count):
+    '''The config for each of count workers. In random order each gets its
+    own seed, drawn from the run's, so that one seed decides the whole
+    run, without every worker shuffling its share alike.'''
+    if config['order'] != 'random':
+        return [config] * count
+    seeds = random.Random(config['seed'])
+    return [dict(config, seed=seeds.randint(1000, 9999))
+            for i in range(count)]
+
+
+def worker(index, files, config, results, abort):
+    try:
+        collector = WithSpecCollector(cache=get_cache(config))
+        time_start = time.time()
+        for filepath, line in files:
+            collector.collect_from_file(filepath, line)
+        time_loading = time.time() - time_start
+        imports = dict((filepath, collected.imports)
+                       for filepath, collected in collector.files.items())
+        results.put(('collected', index, len(collector.tests), time_loading,
+                     imports))
+
+        tests = collector.tests
+        # The parent has decided whether anything failed last time
+        order_tests(config, tests, fallback=False)
+
+        reporting = len(configured_reporters(config)) > 0
+        # The parent needs to know where tests are to remember them
+        definitions = reporting or not config['no_cache']
+        runner = WorkerRunner(hooks=default_hooks(config),
+                              abort=abort,
+                              fail_fast=config['fail_fast'],
+                              dryrun=config['dryrun'],
+                              profile=config['profile'],
+                              concurrency=config['concurrency'],
+                              threads=config['threads'],
+                              keep_output=reporting)
+        def done(test, status, error, output, duration):
+            if status == 'failed' and runner.fail_fast:
+                abort.set()
+            results.put(('result', RemoteTest(test, status, definitions),
+                         status, error, output, duration))
+        runner.scopes.expect(tests)
+        try:
+            runner.run_tests(tests, done)
+        finally:
+            runner.scopes.close()
+        if runner.profile is not None:
+            results.put(('profile', runner.profile))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        results.put(('error', index, traceback.format_exc()))
+    finally:
+        results.put(('done', index))
+
+
+class ParallelRunner(WithSpecRunner):
+    '''Splits spec files across a pool of worker processes.
+
+    Each worker collects and runs its own share of the files, and streams
+    the results back to be recorded and printed here as they arrive.
+    '''
+    def __init__(self, hooks, jobs, config, **kwargs):
+        WithSpecRunner.__init__(self, hooks, **kwargs)
+        self.jobs = jobs
+        self.config = config
+        self.collected = 0
+        self.time_loading = 0.0
+        self.imports = {}  # What each spec file imported, for DependencyMap
+        self.errors = []
+
+    def run(self, files, printer):
+        '''Run the tests found in files, a list of (filepath, line) tuples
+        as returned by `WithSpecCollector.locate`'''
+        config = self.config
+        if config['last_failed']:
+            files, config = self.last_failed(files, config)
+
+        seed = config['seed'] if config['order'] == 'random' else None
+        shares = split_files(files, self.jobs, seed)
+        configs = worker_configs(config, len(shares))
+
+        mp = multiprocessing.get_context()
+        results = mp.Queue()
+        abort = mp.Event()
+        workers = []
+        for index, share in enumerate(shares):
+            process = mp.Process(target=worker,
+                                 args=(index, share, configs[index],
+                                       results, abort))
+            process.daemon = True
+            process.start()
+            workers.append(process)
+        log.info('Started %d workers', len(workers))
+
+        try:
+            self.receive(workers, results, abort, printer)
+        except KeyboardInterrupt:
+            abort.set()
+            for process in workers:
+                process.terminate()
+            raise
+        finally:
+            for process in workers:
+                process.join()
+
+        self.report(printer)
+        if len(self.errors) > 0:
+            for index, error in self.errors:
+                sys.stderr.write(error)
+            raise RuntimeError('%d of %d workers failed' % (len(self.errors),
+                                                           len(workers)))
+
+    def last_failed(self, files, config):
+        '''Decide for the whole run what --last-failed runs, as each
+        worker only sees its own share. Returns the files with a failure
+        to run, or if there are none, every file with the option turned
+        off, along with the config to give the workers.'''
+        history = self.history
+        if history is None:
+            history = History.load(config['cache_dir'])
+        failed = history.failed_files()
+        selected = [(filepath, line) for filepath, line in files
+                    if os.path.abspath(filepath) in failed]
+        if len(selected) == 0:
+            log.warning('No tests failed last time, running them all')
+            return files, dict(config, last_failed=False)
+        return selected, config
+
+    def receive(self, workers, results, abort, printer):
+        running = set(range(len(workers)))
+        while len(running) > 0:
+            try:
+                message = results.get(timeout=0.1)
+            except queue.Empty:
+                # A worker that died without saying so would hang us
+                for index in list(running):
+                    if workers[index].exitcode is not None and \
+                       results.empty():
+                        self.errors.append((index, 'Worker %d exited with '
+                                            'code %d\n' % (
+                                                index,
+                                                workers[index].exitcode)))
+                        running.discard(index)
+                continue
+
+            kind = message[0]
+            if kind == 'result':
+                test, status, error, output, duration = message[1:]
+                if status == 'failed' and self.fail_fast:
+                    abort.set()
+                self.record(test, status, printer, error, output, duration)
+            elif kind == 'collected':
+                index, count, time_loading, imports = message[1:]
+                self.collected += count
+                self.imports.update(imports)
+                self.time_loading = max(self.time_loading, time_loading)
+            elif kind == 'profile':
+                self.profile.merge(message[1])
+            elif kind == 'error':
+                self.errors.append(message[1:])
+            elif kind == 'done':
+                running.discard(message[1])
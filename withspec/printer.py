@@ -1,4 +1,7 @@
 import sys
+import time
+import atexit
+import threading
 
 
 COLOR_NAMES = ["grey", "red", "green", "yellow", "blue", "magenta", "cyan",
@@ -30,10 +33,19 @@ class Printer(object):
         if not raw:
             msg = msg.format(*args, **kwargs)
         if level > 0:
-            self.output.write(self.indent * level)
-        self.output.write(msg)
+            msg = self.indent * level + msg
         if new_line:
-            self.output.write('\n')
+            msg += '\n'
+        self.write(msg)
+
+    def write(self, text):
+        self.output.write(text)
+
+    def flush(self):
+        self.output.flush()
+
+    def close(self):
+        self.flush()
 
     def red(self, msg, *args, **kwargs):
         kwargs['colour'] = 'red'
@@ -56,20 +68,19 @@ class Printer(object):
         self.line(msg, *args, **kwargs)
 
     def new_line(self, number=1):
-        for i in range(number):
-            self.output.write('\n')
+        self.write('\n' * number)
 
     def success(self, test):
         if self.detailed:
             level = self.print_nested(test.parents())
-            self.green(test.name, level=level)
+            self.green(test.name, level=level, raw=True)
         else:
             self.green('.', new_line=False)
 
     def warn(self, test):
         if self.detailed:
             level = self.print_nested(test.parents())
-            self.yellow(test.name, level=level)
+            self.yellow(test.name, level=level, raw=True)
         else:
             self.yellow('*', new_line=False)
 
@@ -77,9 +88,10 @@ class Printer(object):
         if self.detailed:
             level = self.print_nested(test.parents())
             if info is not None:
-                self.red('%s (%s)' % (test.name, info), level=level)
+                self.red('%s (%s)' % (test.name, info), level=level,
+                         raw=True)
             else:
-                self.red(test.name, level=level)
+                self.red(test.name, level=level, raw=True)
         else:
             self.red('F', new_line=False)
 
@@ -96,7 +108,79 @@ class Printer(object):
             if deviated:
                 if i == 0:
                     self.new_line()
-                self.line(new.name, level=i)
+                self.line(new.name, level=i, raw=True)
         self.nesting = nesting
         return i + 1
 
+
+class BufferedPrinter(Printer):
+    '''A Printer which collects its output and writes it in batches, for
+    when every write is slow (eg. a pipe to a CI log).
+
+    A batch is written once it reaches `limit` characters, or `interval`
+    seconds after the last, so progress still shows. With `background` a
+    writer thread does the writing, and wakes every interval to write
+    whatever has been collected, even while a slow test runs. Failures
+    are written straight away, and anything left is written on close or
+    at exit.
+    '''
+    def __init__(self, colour=True, detailed=True, interval=0.2,
+                 limit=8192, background=False):
+        super(BufferedPrinter, self).__init__(colour, detailed)
+        self.interval = interval
+        self.limit = limit
+        self.buffer = []
+        self.size = 0
+        self.lock = threading.Lock()  # Guards the buffer
+        self.write_lock = threading.Lock()  # Keeps batches in order
+        self.last_flush = time.monotonic()
+        self.closed = False
+        self.wake = threading.Event()
+        self.writer = None
+        if background:
+            self.writer = threading.Thread(target=self.write_batches,
+                                           name='withspec-printer')
+            self.writer.daemon = True
+            self.writer.start()
+        atexit.register(self.close)
+
+    def write(self, text):
+        with self.lock:
+            self.buffer.append(text)
+            self.size += len(text)
+            full = self.size >= self.limit
+        if self.writer is not None:
+            if full:
+                self.wake.set()
+        elif full or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                text = ''.join(self.buffer)
+                self.buffer = []
+                self.size = 0
+            if len(text) > 0:
+                self.output.write(text)
+            self.output.flush()
+            self.last_flush = time.monotonic()
+
+    def write_batches(self):
+        while not self.closed:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def error(self, test, info=None):
+        super(BufferedPrinter, self).error(test, info)
+        self.flush()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.writer is not None:
+                self.wake.set()
+                self.writer.join()
+            atexit.unregister(self.close)
+        self.flush()
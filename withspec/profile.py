@@ -0,0 +1,99 @@
+import heapq
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def context_name(context):
+    names = []
+    while context is not None:
+        names.append(context.name)
+        context = context.parent
+    return ' '.join(reversed(names))
+
+
+class Profile(object):
+    '''Collects the wall and CPU time of each test run, along with the
+    before, fixture and after elements in their stacks.
+
+    Only the slowest `count` tests are kept individually, elements and
+    contexts are totalled as they arrive. A fixture scoped wider than a
+    test is only timed when it is set up, not each time its value is
+    looked up. It only holds plain values, so
+    workers can pickle their profile back to be merged.
+    '''
+    def __init__(self, count):
+        self.count = count
+        self.tests = []     # Min heap of (wall, cpu, fullname, definition)
+        self.elements = {}  # (context, kind, name) -> [calls, wall, cpu]
+        self.contexts = {}  # context -> [tests, wall, cpu]
+
+    def add(self, test, wall, cpu, timings):
+        '''Record a test, and timings of (element, wall, cpu) for each
+        step of its stack that ran'''
+        if len(self.tests) < self.count:
+            heapq.heappush(self.tests, (wall, cpu, test.fullname(),
+                                        test.definition()))
+        elif (wall, cpu) > self.tests[0][:2]:
+            heapq.heapreplace(self.tests, (wall, cpu, test.fullname(),
+                                           test.definition()))
+
+        self.total(self.contexts, context_name(test.context), wall, cpu)
+        # The steps of an `Example` are those of the element it is a row of
+        own = getattr(test, 'element', test)
+        for element, element_wall, element_cpu in timings:
+            if element is own:
+                continue
+            key = (context_name(element.context),
+                   element.__class__.__name__[:-len('Element')].lower(),
+                   element.name)
+            self.total(self.elements, key, element_wall, element_cpu)
+
+    def total(self, totals, key, wall, cpu):
+        entry = totals.get(key, None)
+        if entry is None:
+            entry = totals[key] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+
+    def merge(self, other):
+        for entry in other.tests:
+            if len(self.tests) < self.count:
+                heapq.heappush(self.tests, entry)
+            elif entry > self.tests[0]:
+                heapq.heapreplace(self.tests, entry)
+        for totals, others in ((self.elements, other.elements),
+                               (self.contexts, other.contexts)):
+            for key, (calls, wall, cpu) in others.items():
+                entry = totals.setdefault(key, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += wall
+                entry[2] += cpu
+
+    def slowest(self, totals):
+        return sorted(totals.items(), key=lambda item: item[1][1],
+                      reverse=True)[:self.count]
+
+    def report(self, printer):
+        printer.line('Slowest {:d} tests:', len(self.tests))
+        for wall, cpu, fullname, definition in sorted(self.tests,
+                                                      reverse=True):
+            printer.line('{:8.4f}s {:8.4f}s cpu  {}', wall, cpu, fullname,
+                         level=1)
+            printer.line('# {}', definition, level=2, colour='cyan')
+        printer.new_line()
+
+        printer.line('Slowest before, fixture and after elements ' \
+                     '(total over all tests):')
+        for (context, kind, name), (calls, wall, cpu) in \
+                self.slowest(self.elements):
+            printer.line('{:8.4f}s {:8.4f}s cpu {:6d}x  {} {} `{}`',
+                         wall, cpu, calls, context, kind, name, level=1)
+        printer.new_line()
+
+        printer.line('Slowest contexts (total over their own tests):')
+        for context, (calls, wall, cpu) in self.slowest(self.contexts):
+            printer.line('{:8.4f}s {:8.4f}s cpu {:6d}x  {}',
+                         wall, cpu, calls, context, level=1)
+        printer.new_line()
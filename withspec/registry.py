@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 
 
 class RegistryManager(object):
@@ -16,12 +17,49 @@ class RegistryManager(object):
     def pop_context(self):
         return self._context_stack.pop()
 
+    def all_contexts(self):
+        '''Every context added, in the order they were entered'''
+        return tuple(self._all_contexts)
+
     def current_context(self):
         if len(self._context_stack) == 0:
             return None
         return self._context_stack[-1]
 
 
+class SharedIndex(object):
+    '''Every shared example group a collector has collected so far, by
+    name. Each spec file has its own registry, so this is how a group
+    defined in one file is found by contexts in another.
+
+    More than one file can define a group of the same name. The one
+    collected last is used, until its file is forgotten.
+    '''
+    def __init__(self):
+        self.groups = {}  # name -> [(filepath, SharedExamples)], last used
+        self.files = {}   # filepath -> names of the groups it defined
+
+    def add(self, filepath, group):
+        self.groups.setdefault(group.name, []).append((filepath, group))
+        self.files.setdefault(filepath, set()).add(group.name)
+
+    def get(self, name):
+        definitions = self.groups.get(name, None)
+        if definitions is None:
+            return None
+        return definitions[-1][1]
+
+    def forget(self, filepath):
+        '''Drop the groups defined by filepath'''
+        for name in self.files.pop(filepath, ()):
+            definitions = [definition for definition in self.groups[name]
+                           if definition[0] != filepath]
+            if len(definitions) > 0:
+                self.groups[name] = definitions
+            else:
+                del self.groups[name]
+
+
 _registry = RegistryManager()
 
 
@@ -29,3 +67,16 @@ def get_registry():
     return _registry
 
 
+@contextmanager
+def scoped_registry():
+    '''Use a fresh registry for the duration, such as while a single spec
+    file is executed, restoring the previous one afterwards'''
+    global _registry
+    previous = _registry
+    _registry = RegistryManager()
+    try:
+        yield _registry
+    finally:
+        _registry = previous
+
+
@@ -0,0 +1,134 @@
+import sys
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Reporter(object):
+    '''Base for machine readable reporters. Each result is written out as
+    soon as it is recorded, rather than held until the end of the run.
+
+    The path '-' writes to stdout.
+    '''
+    def __init__(self, path):
+        self.path = path
+        if path == '-':
+            self.output = sys.stdout
+        else:
+            self.output = open(path, 'w', encoding='utf-8')
+
+    def result(self, test, status, duration, error=None, output=None):
+        '''Write out the result of a test. Does nothing here.'''
+
+    def close(self, runner):
+        if self.output is sys.stdout:
+            self.output.flush()
+        else:
+            self.output.close()
+
+    def definition(self, test):
+        try:
+            return test.definition()
+        except (TypeError, OSError):
+            return None
+
+
+class JSONLinesReporter(Reporter):
+    '''Writes a JSON object per test, one per line'''
+    def result(self, test, status, duration, error=None, output=None):
+        record = {
+            'name': test.fullname(),
+            'definition': self.definition(test),
+            'status': status,
+            'duration': duration,
+            'error': error,
+            'output': output or [],
+        }
+        self.output.write(json.dumps(record))
+        self.output.write('\n')
+        self.output.flush()
+
+
+class JUnitReporter(Reporter):
+    '''Writes JUnit XML, a testcase element at a time.
+
+    The totals on the testsuite element can only be known at the end, so
+    when the output is a file that can be seeked they are written in to
+    space left for them at the start. Otherwise they are left off.
+    '''
+    header = '<testsuite name="withspec"%s>\n'
+    totals = ' tests="%d" failures="%d" skipped="%d" time="%.6f"'
+    width = len(totals % (0, 0, 0, 0)) + 40
+
+    def __init__(self, path):
+        Reporter.__init__(self, path)
+        self.time = 0.0
+        self.output.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        # Never stdout, even when redirected to a file, as others may be
+        # writing to it too
+        self.seekable = self.output is not sys.stdout and \
+            self.output.seekable()
+        padding = ''
+        if self.seekable:
+            self.start = self.output.tell()
+            padding = ' ' * self.width
+        self.output.write(self.header % padding)
+        self.output.flush()
+
+    def result(self, test, status, duration, error=None, output=None):
+        # Not imported with the module, as it pulls in urllib.request
+        from xml.sax.saxutils import escape, quoteattr
+        self.time += duration or 0.0
+        parents = [context.name for context in test.parents()]
+        self.output.write('  <testcase classname=%s name=%s time="%.6f"' % (
+            quoteattr(' '.join(parents)),
+            quoteattr(test.name),
+            duration or 0.0,
+        ))
+        definition = self.definition(test)
+        if definition is not None:
+            filename, line = definition.rsplit(':', 1)
+            self.output.write(' file=%s line=%s' % (quoteattr(filename),
+                                                    quoteattr(line)))
+        self.output.write('>\n')
+        text = '\n'.join(line for lines in output or () for line in lines)
+        if status == 'failed':
+            self.output.write('    <failure type=%s>%s</failure>\n' % (
+                quoteattr(error or ''), escape(text)))
+        elif status in ('pending', 'skipped'):
+            self.output.write('    <skipped message=%s/>\n' %
+                              quoteattr(status))
+        elif len(text) > 0:
+            self.output.write('    <system-out>%s</system-out>\n' %
+                              escape(text))
+        self.output.write('  </testcase>\n')
+        self.output.flush()
+
+    def close(self, runner):
+        self.output.write('</testsuite>\n')
+        if self.seekable:
+            totals = self.totals % (runner.total,
+                                    len(runner.failed),
+                                    len(runner.skipped) + len(runner.pending),
+                                    self.time)
+            self.output.seek(self.start)
+            self.output.write(self.header % totals.ljust(self.width))
+        Reporter.close(self, runner)
+
+
+# Config key -> the Reporter it turns on
+REPORTERS = (
+    ('json', JSONLinesReporter),
+    ('junit_xml', JUnitReporter),
+)
+
+
+def configured_reporters(config):
+    '''Return (Reporter, path) for each reporter turned on in config'''
+    return [(reporter, config[key]) for key, reporter in REPORTERS
+            if config.get(key) is not None]
+
+
+def open_reporters(config):
+    return [reporter(path) for reporter, path in configured_reporters(config)]
@@ -1,4 +1,8 @@
+import time
 import logging
+import threading
+from .elements import ScopedFixtures
+from .profile import Profile
 
 log = logging.getLogger(__name__)
 
@@ -18,20 +22,28 @@ def exception_formatter(ex):
 
 
 class TestManager(object):
-    def __init__(self, test, hooks):
+    def __init__(self, test, hooks, profile=False):
         self.test = test
         self.hooks = hooks
         self.error = None
         self.output = []
+        self.wall = None
+        self.cpu = None
+        # (element, wall, cpu) for each step of the test's stack
+        self.timings = [] if profile else None
 
     def __enter__(self):
         for hook in self.hooks:
             if hasattr(hook, 'before'):
                 log.debug('Running %s before', str(hook))
                 hook.before(self.test)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
         return self
 
     def __exit__(self, exc, exv, bt):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
         # Run the 'after' hooks in reverse
         if exc is not None:
             self.error = exc.__name__
@@ -50,40 +62,226 @@ class TestManager(object):
 
 
 class WithSpecRunner(object):
-    def __init__(self, hooks, fail_fast=False, dryrun=False):
+    def __init__(self, hooks, fail_fast=False, dryrun=False, profile=0,
+                 reporters=(), concurrency=1, threads=1, history=None):
         self.fail_fast = fail_fast
         self.dryrun = dryrun
         self.hooks = hooks
+        # How many independent coroutine tests may be run at once
+        self.concurrency = concurrency
+        # How many thread safe tests may be run at once
+        self.threads = threads
+        self.lock = threading.Lock()
+        # Remembers how each test went, for ordering the next run
+        self.history = history
+        self.reporters = list(reporters)
+        # Passing tests' output is only wanted by reporters
+        self.keep_output = len(self.reporters) > 0
+        self.scopes = ScopedFixtures()
+        # Keeps the slowest `profile` tests, when asked to
+        self.profile = Profile(profile) if profile > 0 else None
+        self.total = 0
         self.failed = []
         self.skipped = []
         self.pending = []
 
     def run(self, tests, printer):
+        def done(test, status, error, output, duration):
+            self.record(test, status, printer, error, output, duration)
+        self.scopes.expect(tests)
+        try:
+            self.run_tests(tests, done)
+        finally:
+            self.scopes.close()
+        self.report(printer)
+
+    def stream(self, batches, printer):
+        '''As `run`, for tests handed over in batches, such as a spec file
+        at a time. Each batch is run before the next is asked for, and
+        tests which didn't fail are released once recorded, so only the
+        current batch and the failures are held.'''
+        def done(test, status, error, output, duration):
+            self.record(test, status, printer, error, output, duration)
+            if status != 'failed':
+                test.release()
+        try:
+            for tests in batches:
+                self.scopes.expect(tests)
+                self.run_tests(tests, done)
+        finally:
+            self.scopes.close()
+        self.report(printer)
+
+    def run_tests(self, tests, done):
+        '''Run tests, calling done(test, status, error, output, duration)
+        for each in turn. Runs of consecutive tests that can be run
+        alongside each other are run together.'''
+        batch = []
+        mode = None
         for test in tests:
-            if 'pending' in test.tags:
-                self.pending.append(test)
-                printer.warn(test)
-                continue
-            if 'skip' in test.tags:
-                self.skipped.append(test)
-                printer.warn(test)
-                continue
-            # If fail fast and we've failed a test, just skip it
-            if self.fail_fast and len(self.failed) > 0:
-                self.skipped.append(test)
-                printer.warn(test)
-                continue
-
-            # Actually do a test!
-            with TestManager(test, self.hooks) as manager:
-                test.run()
-
-            if manager.error is None:
-                printer.success(test)
+            test_mode = self.batch_mode(test)
+            if len(batch) > 0 and test_mode != mode:
+                self.run_batch(mode, batch, done)
+                batch = []
+            mode = test_mode
+            if mode is None:
+                done(test, *self.run_test(test))
             else:
-                self.failed.append((test, manager.output))
-                printer.error(test, manager.error)
-        
+                batch.append(test)
+        if len(batch) > 0:
+            self.run_batch(mode, batch, done)
+
+    def batch_mode(self, test):
+        '''How test can be run alongside others, if it can. `async` for a
+        coroutine test sharing no fixtures with others, or `thread` for a
+        thread safe one.'''
+        awaits = getattr(test, 'awaits', ())  # Pending tests have no plan
+        if len(awaits) > 0:
+            if self.concurrency < 2:
+                return None
+            for element in test.stack:
+                if element.scope != 'test':
+                    return None
+            return 'async'
+        if self.threads > 1 and test.thread_safe():
+            return 'thread'
+        return None
+
+    def run_batch(self, mode, tests, done):
+        if mode == 'async':
+            self.scopes.loop.run(self.run_coroutines(tests, done))
+        else:
+            self.run_threads(tests, done)
+
+    def run_threads(self, tests, done):
+        '''Run tests across a pool of `threads` threads, reporting each to
+        done in their original order'''
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(self.threads) as pool:
+            futures = [pool.submit(self.outcome, test) for test in tests]
+            try:
+                for test, future in zip(tests, futures):
+                    result = future.result()
+                    self.scopes.finished(test)
+                    done(test, *result)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    async def run_coroutines(self, tests, done):
+        '''Run up to `concurrency` of tests at once, reporting each to done
+        in their original order'''
+        import asyncio  # Already imported by the loop we run on
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def run_test(test):
+            async with semaphore:
+                return await self.outcome_async(test)
+        tasks = [asyncio.ensure_future(run_test(test)) for test in tests]
+        try:
+            for test, task in zip(tests, tasks):
+                result = await task
+                self.scopes.finished(test)
+                done(test, *result)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stopped(self):
+        '''Whether the remaining tests should be skipped'''
+        return self.fail_fast and len(self.failed) > 0
+
+    def run_test(self, test):
+        '''Run a single test, without recording or printing anything.
+
+        Returns a tuple of (status, error, output, duration), where status
+        is one of `passed`, `failed`, `pending` or `skipped`. duration is
+        None for tests which weren't run.
+        '''
+        result = self.outcome(test)
+        self.scopes.finished(test)
+        return result
+
+    def not_run(self, test):
+        '''Return the outcome of a test that isn't to be run, or None'''
+        if 'pending' in test.tags:
+            return 'pending', None, None, None
+        if 'skip' in test.tags:
+            return 'skipped', None, None, None
+        # If fail fast and we've failed a test, just skip it
+        if self.stopped():
+            return 'skipped', None, None, None
+        return None
+
+    def outcome(self, test):
+        result = self.not_run(test)
+        if result is not None:
+            return result
+
+        # Actually do a test!
+        with TestManager(test, self.hooks,
+                         profile=self.profile is not None) as manager:
+            test.run(self.scopes, manager.timings)
+        return self.result(test, manager)
+
+    async def outcome_async(self, test):
+        '''As `outcome`, for a coroutine test run alongside others'''
+        result = self.not_run(test)
+        if result is not None:
+            return result
+        with TestManager(test, self.hooks,
+                         profile=self.profile is not None) as manager:
+            await test.run_async(self.scopes, manager.timings)
+        return self.result(test, manager)
+
+    def result(self, test, manager):
+        if self.profile is not None:
+            with self.lock:
+                self.profile.add(test, manager.wall, manager.cpu,
+                                 manager.timings)
+
+        if manager.error is None:
+            if self.keep_output and len(manager.output) > 0:
+                return 'passed', None, self.lines(manager), manager.wall
+            # Nobody will read it, so it is never formatted
+            return 'passed', None, None, manager.wall
+        return 'failed', manager.error, self.lines(manager), manager.wall
+
+    def lines(self, manager):
+        '''Format the output the hooks captured. They hand it back lazily
+        (and possibly as generators), but we may have several readers.'''
+        output = []
+        for lines in manager.output:
+            lines = list(lines)
+            if len(lines) > 0:
+                output.append(lines)
+        return output
+
+    def record(self, test, status, printer, error=None, output=None,
+               duration=None):
+        self.total += 1
+        for reporter in self.reporters:
+            reporter.result(test, status, duration, error, output)
+        if self.history is not None:
+            self.history.record(test, status, duration)
+        if status == 'pending':
+            self.pending.append(test)
+            printer.warn(test)
+        elif status == 'skipped':
+            self.skipped.append(test)
+            printer.warn(test)
+        elif status == 'failed':
+            self.failed.append((test, output))
+            printer.error(test, error)
+        else:
+            printer.success(test)
+
+    def close(self):
+        for reporter in self.reporters:
+            reporter.close(self)
+        if self.history is not None:
+            self.history.save()
+
+    def report(self, printer):
         printer.new_line()
         if len(self.failed) > 0:
             printer.new_line()
@@ -99,5 +297,3 @@ class WithSpecRunner(object):
                     for line in error:
                         printer.line(line, level=2, colour=colour, raw=True)
                 printer.new_line()
-
-
@@ -2,6 +2,11 @@ import inspect
 
 
 def arg_names(func):
-    args, varargs, keywords, defaults = inspect.getargspec(func)
-    return args
+    return tuple(inspect.getfullargspec(func).args)
 
+
+def is_async(func):
+    '''Whether calling func gives something to be awaited or iterated
+    asynchronously'''
+    return inspect.iscoroutinefunction(func) or \
+        inspect.isasyncgenfunction(func)
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Watcher(object):
+    '''Polls the spec locations, and the project files the specs import,
+    for files that have been changed, added or removed. Only the standard
+    library is used, so this simply compares modification times.
+    '''
+    def __init__(self, collector, locations, interval=0.5):
+        self.collector = collector
+        self.locations = locations
+        self.interval = interval
+        self.specs = set()  # The spec files found in the last scan
+        self.mtimes = self.scan()
+
+    def scan(self):
+        mtimes = {}
+        specs = set()
+        for location in self.locations:
+            try:
+                files = self.collector.locate(location)
+            except ValueError:
+                continue  # Removed, it may well come back
+            for filepath, line in files:
+                specs.add(filepath)
+                self.stat(mtimes, filepath)
+        # And the project files that the specs import
+        seen = set(os.path.abspath(filepath) for filepath in specs)
+        for collected in list(self.collector.files.values()):
+            for filepath in collected.imports:
+                if filepath not in seen:
+                    seen.add(filepath)
+                    self.stat(mtimes, filepath)
+        self.specs = specs
+        return mtimes
+
+    def stat(self, mtimes, filepath):
+        try:
+            mtimes[filepath] = os.stat(filepath).st_mtime_ns
+        except OSError:
+            pass
+
+    def changes(self):
+        '''Return the files changed, and those removed, since we last
+        looked'''
+        mtimes = self.scan()
+        changed = [filepath for filepath, mtime in mtimes.items()
+                   if self.mtimes.get(filepath) != mtime]
+        removed = [filepath for filepath in self.mtimes
+                   if filepath not in mtimes]
+        self.mtimes = mtimes
+        return sorted(changed), sorted(removed)
+
+    def wait(self):
+        '''Block until something changes'''
+        while True:
+            changed, removed = self.changes()
+            if len(changed) > 0 or len(removed) > 0:
+                log.debug('Changed: %s, Removed: %s', changed, removed)
+                return changed, removed
+            time.sleep(self.interval)
+
+
+def loaded_modules(filepaths):
+    '''Return the modules already imported from any of filepaths'''
+    wanted = set(os.path.abspath(filepath) for filepath in filepaths)
+    modules = []
+    for module in list(sys.modules.values()):
+        filename = getattr(module, '__file__', None)
+        if filename is not None and os.path.abspath(filename) in wanted:
+            modules.append(module)
+    return modules